@@ -4,14 +4,20 @@ This validates the system against historical transactions with known fraud outco
 """
 
 import pandas as pd
+import numpy as np
 import os
+import sqlite3
 import logging
 from datetime import datetime
 
 logging.disable(logging.CRITICAL)
 
 from src.antifraud import check_antifraud, update_cbk
-from src.models import Transaction
+from src.models import Transaction, hash_card, parse_transaction_date
+from src.scoring import build_features, FEATURES
+from src.settings import settings
+from src.state import WindowState
+from src.decision_log import read_decisions, rule_name, RECOMMENDATION_CODES
 from src.database import init_db, get_db
 from src import database
 
@@ -189,6 +195,109 @@ def load_and_test_csv(csv_path='data/transactional-sample.csv'):
     
     return results, recommendations
 
+def build_feature_matrix(df):
+    """
+    Replay transactions in time order through a fresh window state with the
+    live rule limits and return (X, y) for the transactions the rules approve,
+    i.e. the ones the risk model scores in production: their features as seen
+    before they were recorded, and whether they had a chargeback.
+    Denied transactions never enter the windows, as in serving.
+    """
+    df = df.sort_values('transaction_date')
+    state = WindowState(max_future=float('inf'))
+    X = []
+    approved = []
+    
+    for row in df.itertuples(index=False):
+        ts = parse_transaction_date(str(row.transaction_date)).timestamp()
+        device_id = int(row.device_id) if pd.notna(row.device_id) else None
+        check = state.check_and_add(
+            int(row.transaction_id), int(row.user_id), ts, float(row.transaction_amount),
+            settings.max_transactions_per_2min, settings.max_amount_per_24h,
+            device_id=device_id, card_hash=hash_card(str(row.card_number)),
+            max_devices=settings.max_distinct_devices_per_24h,
+            max_cards=settings.max_distinct_cards_per_24h
+        )
+        approved.append(check.rule is None)
+        if check.rule is None:
+            X.append(build_features(float(row.transaction_amount), check))
+    
+    y = (df['has_cbk'] == True).to_numpy(dtype=np.float64)[np.asarray(approved, dtype=bool)]
+    return np.asarray(X, dtype=np.float64).reshape(-1, len(FEATURES)), y
+
+def analyze_decision_log(log_dir, csv_path=None, db_file=None):
+    """
+    Join chargeback labels to the production decision log and report real
+    deny rates, rule attribution and false positive / negative rates.
+    Labels come from `transactions.has_cbk` in the database (where update_cbk
+    records chargebacks), plus the historical CSV for transactions not stored
+    there. Decisions without a label are left out of the error rates, which
+    are only reported when some denials are labelled: denied transactions are
+    never stored, so live traffic alone only labels approvals.
+    """
+    records = read_decisions(log_dir)
+    decisions = pd.DataFrame({
+        'transaction_id': records['transaction_id'],
+        'rule': [rule_name(int(code)) or 'approved' for code in records['rule']],
+        'denied': records['recommendation'] == RECOMMENDATION_CODES['deny'],
+        'amount': records['amount'],
+    })
+    # Retries are logged as replays of the first decision; keep the first one
+    decisions = decisions[decisions['rule'] != 'replay'].drop_duplicates('transaction_id')
+    
+    conn = sqlite3.connect(db_file or database.DB_FILE)
+    try:
+        labels = pd.read_sql_query("SELECT transaction_id, has_cbk FROM transactions", conn)
+    finally:
+        conn.close()
+    if csv_path and os.path.exists(csv_path):
+        historical = pd.read_csv(csv_path, usecols=['transaction_id', 'has_cbk'])
+        labels = pd.concat([labels, historical[~historical['transaction_id'].isin(labels['transaction_id'])]])
+    labels['has_cbk'] = labels['has_cbk'].astype(bool)
+    
+    joined = decisions.merge(labels, on='transaction_id', how='left')
+    joined['fraud'] = joined['has_cbk'] == True
+    labelled = joined[joined['has_cbk'].notna()]
+    
+    print("\n" + "=" * 70)
+    print("              PRODUCTION DECISIONS (DECISION LOG)")
+    print("=" * 70)
+    print(f"\nLog: {log_dir} | Decisions: {len(joined):,} | With chargeback label: {len(labelled):,}")
+    print(f"Deny rate: {joined['denied'].mean() * 100 if len(joined) else 0:.2f}%")
+    
+    denied = joined[joined['denied']]
+    labelled_approved = labelled[~labelled['denied']]
+    labelled_denied = labelled[labelled['denied']]
+    print(f"Labelled: {len(labelled_approved):,} of {len(joined) - len(denied):,} approved, "
+          f"{len(labelled_denied):,} of {len(denied):,} denied")
+    print(f"Chargeback rate of approved: "
+          f"{labelled_approved['fraud'].mean() * 100 if len(labelled_approved) else 0:.2f}% "
+          f"({labelled_approved['fraud'].sum()} frauds approved)")
+    if len(labelled_denied):
+        legitimate = labelled[~labelled['fraud']]
+        frauds = labelled[labelled['fraud']]
+        print(f"False positive rate: {legitimate['denied'].mean() * 100 if len(legitimate) else 0:.2f}% "
+              f"({legitimate['denied'].sum()} legitimate denied)")
+        print(f"False negative rate: {(~frauds['denied']).mean() * 100 if len(frauds) else 0:.2f}% "
+              f"({(~frauds['denied']).sum()} frauds approved)")
+        if len(labelled_denied) < len(denied):
+            print("   Note: rates cover labelled decisions only; unlabelled denials are left out")
+    else:
+        # Denied transactions are never stored, so chargebacks are only ever
+        # recorded against approvals; rates over them would read 0% FP / 100% FN
+        print("False positive / negative rates: n/a (no denied decision has a chargeback label;")
+        print("   denied transactions are never stored, pass the historical CSV to label them)")
+    print(f"\nRULE ATTRIBUTION:")
+    by_rule = joined.groupby('rule').agg(decisions=('transaction_id', 'size'), labelled=('has_cbk', 'count'),
+                                         frauds=('fraud', 'sum'), amount=('amount', 'sum'))
+    for rule, row in by_rule.sort_values('decisions', ascending=False).iterrows():
+        precision = f"{row['frauds'] / row['labelled'] * 100:5.1f}%" if row['labelled'] else "  n/a"
+        print(f"   {rule:20} {int(row['decisions']):8,} decisions | {int(row['frauds']):5} frauds "
+              f"of {int(row['labelled']):,} labelled ({precision}) | ${row['amount']:,.2f}")
+    
+    print("\n" + "=" * 70)
+    return joined
+
 def analyze_rule_effectiveness(csv_path='data/transactional-sample.csv'):
     """
     Analyze which rules are most effective.
@@ -274,7 +383,9 @@ def analyze_rule_effectiveness(csv_path='data/transactional-sample.csv'):
 if __name__ == "__main__":
     import sys
     
-    csv_file = sys.argv[1] if len(sys.argv) > 1 else 'data/transactional-sample.csv'
+    args = [a for a in sys.argv[1:] if not a.startswith('--decision-log=')]
+    log_dirs = [a.split('=', 1)[1] for a in sys.argv[1:] if a.startswith('--decision-log=')]
+    csv_file = args[0] if args else 'data/transactional-sample.csv'
     
     if not os.path.exists(csv_file):
         print(f"\nERROR: File '{csv_file}' not found!")
@@ -286,6 +397,10 @@ if __name__ == "__main__":
     print("=" * 70)
     print(f"Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
     
+    if log_dirs:
+        analyze_decision_log(log_dirs[0], csv_file)
+        sys.exit(0)
+    
     results, recommendations = load_and_test_csv(csv_file)
     
     analyze_rule_effectiveness(csv_file)
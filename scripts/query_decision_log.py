@@ -0,0 +1,54 @@
+"""
+Script to query the append-only decision log.
+Scans the segment files (memory-mapped, vectorized with NumPy) and prints
+deny rates and per-rule aggregates for a time range.
+
+Usage: python3 scripts/query_decision_log.py [log_dir] [--since ISO_DATE] [--until ISO_DATE]
+"""
+
+import argparse
+import os
+import sys
+
+import numpy as np
+
+from src.models import parse_transaction_date
+from src.decision_log import read_decisions, aggregate_by_rule, segment_paths, RECOMMENDATION_CODES
+
+def parse_time(value):
+    return parse_transaction_date(value).timestamp() if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the anti-fraud decision log")
+    parser.add_argument('log_dir', nargs='?', default=os.environ.get('DECISION_LOG_DIR', 'data/decisions'))
+    parser.add_argument('--since', help="Only decisions at or after this ISO date")
+    parser.add_argument('--until', help="Only decisions before this ISO date")
+    args = parser.parse_args()
+    
+    if not segment_paths(args.log_dir):
+        print(f"\nERROR: No decision log segments in '{args.log_dir}'")
+        sys.exit(1)
+    
+    records = read_decisions(args.log_dir, parse_time(args.since), parse_time(args.until))
+    total = len(records)
+    denied = int((records['recommendation'] == RECOMMENDATION_CODES['deny']).sum())
+    
+    print("\n" + "=" * 70)
+    print("                    DECISION LOG REPORT")
+    print("=" * 70)
+    print(f"\nLog: {args.log_dir} ({len(segment_paths(args.log_dir))} segments)")
+    print(f"Range: {args.since or 'beginning'} -> {args.until or 'now'}")
+    print(f"Decisions: {total:,} | Denied: {denied:,} ({denied / total * 100 if total else 0:.1f}%)")
+    if total:
+        print(f"Latency: p50 {np.percentile(records['latency_us'], 50):,.0f}us | "
+              f"p99 {np.percentile(records['latency_us'], 99):,.0f}us")
+    
+    print(f"\nBY RULE:")
+    print(f"   {'rule':20} {'decisions':>10} {'share':>7} {'amount':>14} {'p50 us':>9} {'p99 us':>9}")
+    for rule, stats in sorted(aggregate_by_rule(records).items(), key=lambda x: -x[1]['decisions']):
+        print(f"   {rule:20} {stats['decisions']:10,} {stats['decisions'] / total * 100:6.1f}% "
+              f"${stats['amount']:13,.2f} {stats['latency_p50_us']:9,.0f} {stats['latency_p99_us']:9,.0f}")
+    print("\n" + "=" * 70)
+
+if __name__ == "__main__":
+    main()
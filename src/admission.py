@@ -0,0 +1,136 @@
+"""
+Admission control for /antifraud.
+Bounds the number of in-flight decisions and gives each one a deadline.
+When a request is shed (too many in flight or deadline missed) the
+configured fail-open/fail-closed recommendation is returned instead.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.settings import settings
+
+SHED_OVERLOAD = 'overload'
+SHED_DEADLINE = 'deadline'
+
+_COMMIT = 'commit'
+_SHED = 'shed'
+
+class _Deadline:
+    """A request's deadline and who got to decide it: the worker (commit) or the endpoint (shed)"""
+
+    __slots__ = ('expires_at', 'outcome', '_lock')
+
+    def __init__(self, expires_at):
+        self.expires_at = expires_at
+        self.outcome = None
+        self._lock = threading.Lock()
+
+    def claim(self, outcome) -> bool:
+        with self._lock:
+            if self.outcome is None:
+                self.outcome = outcome
+            return self.outcome == outcome
+
+_deadline: ContextVar[_Deadline | None] = ContextVar('deadline', default=None)
+
+class DeadlineExceeded(Exception):
+    """Raised when a decision cannot be made before the request deadline"""
+
+@contextmanager
+def deadline(seconds: float | None):
+    """Set a deadline (monotonic clock) for the current context"""
+    token = _deadline.set(_Deadline(time.monotonic() + seconds) if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def current_deadline() -> float | None:
+    current = _deadline.get()
+    return None if current is None else current.expires_at
+
+def remaining() -> float | None:
+    """Seconds left before the deadline, or None if there is none"""
+    expires_at = current_deadline()
+    return None if expires_at is None else expires_at - time.monotonic()
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current deadline has passed"""
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded('Request deadline exceeded')
+
+def claim_commit():
+    """
+    Claim the right to store (or log) the current request's decision. Raises
+    DeadlineExceeded if the deadline has passed or the request was already
+    shed, so a stored decision can never contradict the fallback answer.
+    """
+    current = _deadline.get()
+    if current is None:
+        return
+    if time.monotonic() >= current.expires_at:
+        current.claim(_SHED)
+    if not current.claim(_COMMIT):
+        raise DeadlineExceeded('Request already shed')
+
+def claim_shed() -> bool:
+    """Claim the current request for shedding; False if its decision is already being stored"""
+    current = _deadline.get()
+    return current is None or current.claim(_SHED)
+
+class AdmissionController:
+    """Bounded in-flight counter with shed statistics"""
+
+    def __init__(self, max_in_flight: int, deadline_seconds: float, fail_policy: str):
+        if fail_policy not in ('open', 'closed'):
+            raise ValueError("fail_policy must be 'open' or 'closed'")
+        self.max_in_flight = max_in_flight
+        self.deadline_seconds = deadline_seconds
+        self.fail_policy = fail_policy
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = {SHED_OVERLOAD: 0, SHED_DEADLINE: 0}
+
+    @property
+    def fallback_recommendation(self):
+        return 'approve' if self.fail_policy == 'open' else 'deny'
+
+    def try_acquire(self) -> bool:
+        """Admit a request unless the in-flight limit is reached"""
+        with self._lock:
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.shed[SHED_OVERLOAD] += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_deadline_miss(self):
+        with self._lock:
+            self.shed[SHED_DEADLINE] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "deadline_ms": self.deadline_seconds * 1000,
+                "fail_policy": self.fail_policy,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+            }
+
+admission = AdmissionController(
+    settings.admission_max_in_flight,
+    settings.admission_deadline_ms / 1000,
+    settings.admission_fail_policy,
+)
@@ -1,6 +1,20 @@
-from datetime import datetime, timedelta
+from datetime import datetime
 from src.database import get_db
+from src.models import parse_transaction_date
+from src.admission import check_deadline, claim_commit, DeadlineExceeded
+from src.decision_log import decision_log, RULE_REPLAY, RULE_INVALID_DATE, RULE_STORE_ERROR
+from src.idempotency import decision_cache, load_decision, save_decision
+from src.shadow import shadow
+from src.profiling import span
+from src.scoring import get_risk_scorer, build_features, RULE_RISK_SCORE
+from src.settings import settings
+from src.state import (
+    get_window_state, RULE_CHARGEBACK, RULE_LINKED_CHARGEBACK, RULE_VELOCITY, RULE_AMOUNT, RULE_LATE,
+    RULE_FUTURE, RULE_DUPLICATE, RULE_DISTINCT_DEVICES, RULE_DISTINCT_CARDS
+)
+import sqlite3
 import logging
+import time
 
 logging.basicConfig(
     level=logging.INFO,
@@ -11,83 +25,250 @@ logger = logging.getLogger(__name__)
 MAX_TRANSACTIONS_IN_2MIN = 3
 MAX_AMOUNT_IN_24H = 1000.0
 
+# How long a retry waits for its in-flight original to store a decision
+DUPLICATE_WAIT_SECONDS = 1.0
+DUPLICATE_POLL_SECONDS = 0.005
+
 def check_antifraud(txn):
     """
     Check if a transaction should be approved or denied based on anti-fraud rules.
     
     Rules:
-    1. Deny if user had prior chargeback
+    1. Deny if user had prior chargeback, or shares a card/device cluster with one
     2. Deny if >3 transactions in 2 minutes
     3. Deny if sum of last 24h + current transaction > $1000
+    4. Deny if distinct devices in 24h > MAX_DISTINCT_DEVICES_PER_24H (if set)
+    5. Deny if distinct cards in 24h > MAX_DISTINCT_CARDS_PER_24H (if set)
+    6. Deny if the risk model (RISK_MODEL_PATH, if set) scores above its threshold
+    
+    Windows are evaluated in event time ([t-2min, t] and [t-24h, t]), so
+    out-of-order transactions get the same decision as in-order ones; events
+    later than MAX_EVENT_LATENESS_SECONDS, or dated more than
+    MAX_EVENT_FUTURE_SECONDS ahead of now, are denied.
+    
+    Decisions are idempotent per transaction_id: a retried transaction gets
+    its original recommendation back without being evaluated again.
+    
+    Every decision is appended to the decision log (if DECISION_LOG_DIR is set).
     """
-    logger.info(f"Processing transaction {txn.transaction_id} for user {txn.user_id}")
+    start = time.perf_counter()
+    recommendation, rule = _decide(txn)
+    # A request shed meanwhile was already logged with the fallback answer
+    claim_commit()
+    decision_log.record(txn, recommendation, rule, time.perf_counter() - start)
+    return recommendation
+
+def _decide(txn):
+    """Return (recommendation, rule that decided it or None for an approval)"""
+    with span('logging'):
+        logger.info(f"Processing transaction {txn.transaction_id} for user {txn.user_id}")
+    
+    cached = decision_cache.get(txn.transaction_id)
+    if cached is not None:
+        logger.info(f"REPLAYED: Transaction {txn.transaction_id} already decided ({cached})")
+        return cached, RULE_REPLAY
     
     try:
-        dt = datetime.fromisoformat(txn.transaction_date)
+        with span('parse_date'):
+            dt = parse_transaction_date(txn.transaction_date)
     except ValueError:
         logger.error(f"DENIED: Invalid date for transaction {txn.transaction_id}")
-        return 'deny'
+        return 'deny', RULE_INVALID_DATE
     
-    card_hash = txn.get_card_hash()
+    with span('hash_card'):
+        card_hash = txn.get_card_hash()
+    link_card = not txn.is_card_masked()
     
     with get_db() as conn:
         cur = conn.cursor()
         
-        # Rule 1: Check prior chargeback
-        cur.execute("SELECT has_prior_cbk FROM users WHERE user_id = ?", (txn.user_id,))
-        prior_cbk = cur.fetchone()
-        if prior_cbk and prior_cbk[0]:
-            logger.warning(f"DENIED: User {txn.user_id} has prior chargeback (transaction {txn.transaction_id})")
-            return 'deny'
+        with span('idempotency_lookup'):
+            stored = load_decision(cur, txn.transaction_id)
+        if stored is not None:
+            logger.info(f"REPLAYED: Transaction {txn.transaction_id} already decided ({stored})")
+            decision_cache.put(txn.transaction_id, stored)
+            return stored, RULE_REPLAY
         
-        # Rule 2: Check too many in row (>=3 in 2 min, so 4th would be denied)
-        recent_time = dt - timedelta(minutes=2)
-        cur.execute("""
-            SELECT COUNT(*) FROM transactions
-            WHERE user_id = ? AND datetime(transaction_date) > datetime(?)
-        """, (txn.user_id, recent_time.isoformat()))
-        count_recent = cur.fetchone()[0]
-
-        if count_recent >= MAX_TRANSACTIONS_IN_2MIN:
-            logger.warning(
-                f"DENIED: User {txn.user_id} exceeded transaction limit "
-                f"({count_recent} transactions in 2 minutes, attempting {count_recent + 1}) - transaction {txn.transaction_id}"
-            )
-            return 'deny'
-        
-        # Rule 3: Check amount in period (>1000 in 24h)
-        day_ago = dt - timedelta(hours=24)
-        cur.execute("""
-            SELECT SUM(transaction_amount) FROM transactions
-            WHERE user_id = ? AND datetime(transaction_date) > ?
-        """, (txn.user_id, day_ago.isoformat()))
-        total_day = cur.fetchone()[0] or 0
-        if total_day + txn.transaction_amount > MAX_AMOUNT_IN_24H:
-            logger.warning(
-                f"DENIED: User {txn.user_id} exceeded amount limit "
-                f"(${total_day:.2f} + ${txn.transaction_amount:.2f} > ${MAX_AMOUNT_IN_24H}) "
-                f"- transaction {txn.transaction_id}"
-            )
-            return 'deny'
+        state = get_window_state()
+        rule = _apply_rules(state, txn, dt, card_hash, link_card)
+        if rule == RULE_DUPLICATE:
+            # The original request is still in flight: replay its decision
+            stored = _wait_for_original(cur, state, txn)
+            if stored is not None:
+                logger.info(f"REPLAYED: Transaction {txn.transaction_id} already decided ({stored})")
+                decision_cache.put(txn.transaction_id, stored)
+                return stored, RULE_REPLAY
+            # The original gave up without storing anything: evaluate afresh
+            rule = _apply_rules(state, txn, dt, card_hash, link_card)
+            if rule == RULE_DUPLICATE:
+                logger.error(f"DENIED: Transaction {txn.transaction_id} is still being decided by another request")
+                return 'deny', RULE_STORE_ERROR
+        if rule is not None:
+            with span('store'):
+                save_decision(cur, txn.transaction_id, 'deny', datetime.now().isoformat())
+                claim_commit()
+                conn.commit()
+                stored = load_decision(cur, txn.transaction_id)
+            decision_cache.put(txn.transaction_id, stored)
+            if stored != 'deny':
+                # A concurrent request stored its decision first
+                logger.info(f"REPLAYED: Transaction {txn.transaction_id} already decided ({stored})")
+                return stored, RULE_REPLAY
+            shadow.submit(txn, dt, 'deny', rule, prior_cbk=rule in (RULE_CHARGEBACK, RULE_LINKED_CHARGEBACK))
+            return 'deny', rule
         
         try:
-            cur.execute("""
-                INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (txn.transaction_id, txn.merchant_id, txn.user_id, card_hash,
-                  txn.transaction_date, txn.transaction_amount, txn.device_id, False))
+            with span('store'):
+                cur.execute("""
+                    INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, (txn.transaction_id, txn.merchant_id, txn.user_id, card_hash,
+                      txn.transaction_date, txn.transaction_amount, txn.device_id, False))
+                
+                cur.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (txn.user_id,))
+                if link_card:
+                    cur.execute("INSERT OR IGNORE INTO linkable_cards (card_hash) VALUES (?)", (card_hash,))
+                save_decision(cur, txn.transaction_id, 'approve', datetime.now().isoformat())
+                claim_commit()
+                conn.commit()
             
-            cur.execute("INSERT OR IGNORE INTO users (user_id) VALUES (?)", (txn.user_id,))
-            conn.commit()
-            
-            logger.info(
-                f"APPROVED: Transaction {txn.transaction_id} for user {txn.user_id} "
-                f"- ${txn.transaction_amount:.2f}"
-            )
+            with span('logging'):
+                logger.info(
+                    f"APPROVED: Transaction {txn.transaction_id} for user {txn.user_id} "
+                    f"- ${txn.transaction_amount:.2f}"
+                )
+        except sqlite3.IntegrityError:
+            # A concurrent retry stored this transaction first: return its decision
+            conn.rollback()
+            state.remove(txn.user_id, txn.transaction_id)
+            stored = load_decision(cur, txn.transaction_id) or 'approve'
+            logger.info(f"REPLAYED: Transaction {txn.transaction_id} already decided ({stored})")
+            decision_cache.put(txn.transaction_id, stored)
+            return stored, RULE_REPLAY
+        except DeadlineExceeded:
+            # The request was shed: store nothing so a retry is evaluated afresh
+            conn.rollback()
+            state.remove(txn.user_id, txn.transaction_id)
+            raise
         except Exception as e:
             logger.error(f"Error storing transaction {txn.transaction_id}: {e}")
-            return 'deny'
+            conn.rollback()
+            state.remove(txn.user_id, txn.transaction_id)
+            check_deadline()
+            return 'deny', RULE_STORE_ERROR
+    
+    decision_cache.put(txn.transaction_id, 'approve')
+    shadow.submit(txn, dt, 'approve', None, prior_cbk=False)
+    return 'approve', None
+
+def _wait_for_original(cur, state, txn):
+    """
+    Poll for the decision of a concurrent request for the same transaction.
+    Returns None if it went away without storing one (or took too long).
+    """
+    give_up = time.monotonic() + DUPLICATE_WAIT_SECONDS
+    while True:
+        stored = load_decision(cur, txn.transaction_id)
+        if stored is not None:
+            return stored
+        if time.monotonic() >= give_up or not state.is_recorded(txn.user_id, txn.transaction_id):
+            return load_decision(cur, txn.transaction_id)
+        check_deadline()
+        time.sleep(DUPLICATE_POLL_SECONDS)
+
+def _apply_rules(state, txn, dt, card_hash, link_card):
+    """
+    Return the name of the rule that denies the transaction, or None to approve.
+    An approved transaction is recorded in the window state; with a risk
+    model it is only reserved until the score has approved it too.
+    """
+    scorer = get_risk_scorer()
+    with span('window_state'):
+        check = state.check_and_add(
+            txn.transaction_id, txn.user_id, dt.timestamp(), txn.transaction_amount,
+            MAX_TRANSACTIONS_IN_2MIN, MAX_AMOUNT_IN_24H,
+            device_id=txn.device_id, card_hash=card_hash,
+            max_devices=settings.max_distinct_devices_per_24h,
+            max_cards=settings.max_distinct_cards_per_24h,
+            provisional=scorer is not None, link_card=link_card
+        )
+    rule, count_recent, total_day = check.rule, check.count_recent, check.total_day
+    distinct_devices, distinct_cards = check.distinct_devices, check.distinct_cards
+    
+    if rule == RULE_DUPLICATE:
+        logger.info(f"Transaction {txn.transaction_id} is already being decided by a concurrent request")
+    
+    elif rule == RULE_LATE:
+        logger.warning(
+            f"DENIED: Transaction {txn.transaction_id} for user {txn.user_id} arrived more than "
+            f"{settings.max_event_lateness_seconds:.0f}s behind the user's newest transaction"
+        )
+    
+    elif rule == RULE_FUTURE:
+        logger.warning(
+            f"DENIED: Transaction {txn.transaction_id} for user {txn.user_id} is dated more than "
+            f"{settings.max_event_future_seconds:.0f}s in the future ({txn.transaction_date})"
+        )
+    
+    # Rule 1: Prior chargeback
+    elif rule == RULE_CHARGEBACK:
+        logger.warning(f"DENIED: User {txn.user_id} has prior chargeback (transaction {txn.transaction_id})")
+    
+    # Rule 1b: Linked (shared card/device) to a user with prior chargeback
+    elif rule == RULE_LINKED_CHARGEBACK:
+        logger.warning(
+            f"DENIED: User {txn.user_id}, its card or device is linked to a user with prior chargeback "
+            f"(transaction {txn.transaction_id})"
+        )
+    
+    # Rule 2: Too many in row (>=3 in 2 min, so 4th would be denied)
+    elif rule == RULE_VELOCITY:
+        logger.warning(
+            f"DENIED: User {txn.user_id} exceeded transaction limit "
+            f"({count_recent} transactions in 2 minutes, attempting {count_recent + 1}) - transaction {txn.transaction_id}"
+        )
+    
+    # Rule 3: Amount in period (>1000 in 24h)
+    elif rule == RULE_AMOUNT:
+        logger.warning(
+            f"DENIED: User {txn.user_id} exceeded amount limit "
+            f"(${total_day:.2f} + ${txn.transaction_amount:.2f} > ${MAX_AMOUNT_IN_24H}) "
+            f"- transaction {txn.transaction_id}"
+        )
+    
+    # Rule 4: Too many distinct devices in 24h (approximate, account takeover)
+    elif rule == RULE_DISTINCT_DEVICES:
+        logger.warning(
+            f"DENIED: User {txn.user_id} used ~{distinct_devices:.0f} distinct devices in 24h "
+            f"(limit {settings.max_distinct_devices_per_24h}) - transaction {txn.transaction_id}"
+        )
+    
+    # Rule 5: Too many distinct cards in 24h (approximate, card testing)
+    elif rule == RULE_DISTINCT_CARDS:
+        logger.warning(
+            f"DENIED: User {txn.user_id} used ~{distinct_cards:.0f} distinct cards in 24h "
+            f"(limit {settings.max_distinct_cards_per_24h}) - transaction {txn.transaction_id}"
+        )
+    
+    # Rule 6: Risk score of transactions that passed every other rule
+    elif scorer is not None:
+        try:
+            with span('risk_score'):
+                score = scorer.score(build_features(txn.transaction_amount, check))
+        except Exception:
+            state.remove(txn.user_id, txn.transaction_id)
+            raise
+        if score >= scorer.model.threshold:
+            state.remove(txn.user_id, txn.transaction_id)
+            logger.warning(
+                f"DENIED: User {txn.user_id} risk score {score:.3f} >= {scorer.model.threshold:.3f} "
+                f"- transaction {txn.transaction_id}"
+            )
+            return RULE_RISK_SCORE
+        with span('window_state'):
+            state.confirm(txn.transaction_id, txn.user_id, dt.timestamp(),
+                          device_id=txn.device_id, card_hash=card_hash, link_card=link_card)
     
-    return 'approve'
+    return rule
 
 def update_cbk(transaction_id, has_cbk):
     """
@@ -109,6 +290,10 @@ def update_cbk(transaction_id, has_cbk):
             cur.execute("SELECT user_id FROM transactions WHERE transaction_id = ?", (transaction_id,))
             result = cur.fetchone()
             if result:
-                logger.warning(f"Chargeback confirmed for transaction {transaction_id} - User {result[0]} marked")
+                cluster_size = get_window_state().block_user(result[0])
+                logger.warning(
+                    f"Chargeback confirmed for transaction {transaction_id} - User {result[0]} marked "
+                    f"(linked cluster of {cluster_size} users/cards/devices blocked)"
+                )
         
         conn.commit()
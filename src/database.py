@@ -1,13 +1,34 @@
 import sqlite3
+import time
 from contextlib import contextmanager
+from src.admission import current_deadline, DeadlineExceeded
+from src.profiling import span
 
 DB_FILE = 'antifraud.db'
 
+# SQLite VM instructions between deadline checks
+PROGRESS_CHECK_INSTRUCTIONS = 1000
+
 @contextmanager
 def get_db():
-    conn = sqlite3.connect(DB_FILE)
+    """
+    Open a connection to DB_FILE. Under a request deadline, lock waits are
+    bounded by the time left and running statements are interrupted once it
+    passes (raising DeadlineExceeded).
+    """
+    expires_at = current_deadline()
+    with span('db_connect'):
+        if expires_at is None:
+            conn = sqlite3.connect(DB_FILE)
+        else:
+            conn = sqlite3.connect(DB_FILE, timeout=max(expires_at - time.monotonic(), 0))
+            conn.set_progress_handler(lambda: time.monotonic() > expires_at, PROGRESS_CHECK_INSTRUCTIONS)
     try:
         yield conn
+    except sqlite3.OperationalError as e:
+        if expires_at is not None and time.monotonic() > expires_at:
+            raise DeadlineExceeded(f'Database operation exceeded request deadline: {e}') from e
+        raise
     finally:
         conn.close()
 
@@ -32,6 +53,32 @@ def init_db():
                 has_prior_cbk BOOLEAN DEFAULT FALSE
             )
         ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS decisions (
+                transaction_id INTEGER PRIMARY KEY,
+                recommendation TEXT NOT NULL,
+                decided_at TEXT
+            )
+        ''')
+        # Hashes of full (unmasked) card numbers, the only cards used as entity links
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS linkable_cards (
+                card_hash TEXT PRIMARY KEY
+            )
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS shadow_disagreements (
+                rule_set TEXT NOT NULL,
+                transaction_id INTEGER NOT NULL,
+                user_id INTEGER,
+                live_recommendation TEXT,
+                shadow_recommendation TEXT,
+                live_rule TEXT,
+                shadow_rule TEXT,
+                recorded_at TEXT,
+                PRIMARY KEY (rule_set, transaction_id)
+            )
+        ''')
         
         cur.execute('CREATE INDEX IF NOT EXISTS idx_user_id ON transactions(user_id)')
         cur.execute('CREATE INDEX IF NOT EXISTS idx_transaction_date ON transactions(transaction_date)')
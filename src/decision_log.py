@@ -0,0 +1,237 @@
+"""
+Append-only decision log.
+Every decision is queued (never blocking the request) and a background
+writer appends fixed-size binary records to rotating segment files. Each
+process writes its own segments (`decisions-<pid>-000001.seg`, ...), so
+several uvicorn workers never share a file. Segments are plain arrays of
+DECISION_DTYPE, so they can be memory-mapped and scanned with NumPy.
+"""
+
+import glob
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+from src.models import parse_transaction_date
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+DECISION_DTYPE = np.dtype([
+    ('transaction_id', '<i8'),
+    ('user_id', '<i8'),
+    ('amount', '<f8'),
+    ('event_time', '<f8'),
+    ('decided_at', '<f8'),
+    ('latency_us', '<f4'),
+    ('rule', 'u1'),
+    ('recommendation', 'u1'),
+])
+
+RULE_REPLAY = 'replay'
+RULE_INVALID_DATE = 'invalid_date'
+RULE_STORE_ERROR = 'store_error'
+RULE_SHED_OVERLOAD = 'shed_overload'
+RULE_SHED_DEADLINE = 'shed_deadline'
+
+# Rule codes are part of the on-disk format: only append to this list
+RULES = [
+    None,
+    'chargeback',
+    'linked_chargeback',
+    'velocity',
+    'amount',
+    'late_event',
+    'distinct_devices',
+    'distinct_cards',
+    'risk_score',
+    RULE_REPLAY,
+    RULE_INVALID_DATE,
+    RULE_STORE_ERROR,
+    RULE_SHED_OVERLOAD,
+    RULE_SHED_DEADLINE,
+    'future_event',
+]
+RULE_CODES = {rule: code for code, rule in enumerate(RULES)}
+RULE_OTHER = 255
+
+RECOMMENDATIONS = ['approve', 'deny']
+RECOMMENDATION_CODES = {r: code for code, r in enumerate(RECOMMENDATIONS)}
+
+SEGMENT_PATTERN = 'decisions-*.seg'
+
+def rule_name(code: int):
+    return RULES[code] if code < len(RULES) else 'other'
+
+def _event_time(transaction_date):
+    try:
+        return parse_transaction_date(transaction_date).timestamp()
+    except (TypeError, ValueError):
+        return float('nan')
+
+class DecisionLog:
+    """Bounded queue plus background writer of segment-rotated decision records"""
+
+    def __init__(self, directory, segment_records=1_000_000, queue_size=100_000, batch_size=1024):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = None
+        self._lock = threading.Lock()
+        self._segment = None
+        self._sequence = 0
+        self._segment_count = 0
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def enabled(self):
+        return bool(self.directory)
+
+    def record(self, txn, recommendation, rule, latency):
+        """Queue a decision; drop it (and count the drop) if the queue is full"""
+        if not self.enabled:
+            return False
+        self._ensure_worker()
+        item = (txn.transaction_id, txn.user_id, txn.transaction_amount, txn.transaction_date,
+                time.time(), latency * 1e6, RULE_CODES.get(rule, RULE_OTHER),
+                RECOMMENDATION_CODES[recommendation])
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def flush(self):
+        """Block until every queued decision has been written"""
+        self._queue.join()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "directory": self.directory,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "segment": self._segment,
+        }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                os.makedirs(self.directory, exist_ok=True)
+                self._open_latest_segment()
+                self._worker = threading.Thread(target=self._run, name="decision-log-writer", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.error(f"Failed to write {len(batch)} decisions: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch):
+        records = np.array([
+            (transaction_id, user_id, amount, _event_time(transaction_date), decided_at, latency_us, rule, rec)
+            for transaction_id, user_id, amount, transaction_date, decided_at, latency_us, rule, rec in batch
+        ], dtype=DECISION_DTYPE)
+
+        start = 0
+        while start < len(records):
+            if self._segment_count >= self.segment_records:
+                self._rotate()
+            chunk = records[start:start + self.segment_records - self._segment_count]
+            with open(self._segment, 'ab') as f:
+                f.write(chunk.tobytes())
+            self._segment_count += len(chunk)
+            self.written += len(chunk)
+            start += len(chunk)
+
+    def _open_latest_segment(self):
+        prefix = f"decisions-{os.getpid()}-"
+        own = sorted(glob.glob(os.path.join(self.directory, prefix + '*.seg')))
+        if own:
+            self._segment = own[-1]
+            self._sequence = int(os.path.basename(self._segment)[len(prefix):-len('.seg')])
+            self._segment_count = os.path.getsize(self._segment) // DECISION_DTYPE.itemsize
+            # Drop a record cut short by a crash so appends stay aligned
+            os.truncate(self._segment, self._segment_count * DECISION_DTYPE.itemsize)
+        else:
+            self._sequence = 1
+            self._segment = _segment_path(self.directory, self._sequence)
+            self._segment_count = 0
+
+    def _rotate(self):
+        self._sequence += 1
+        self._segment = _segment_path(self.directory, self._sequence)
+        self._segment_count = 0
+
+def _segment_path(directory, sequence):
+    return os.path.join(directory, f"decisions-{os.getpid()}-{sequence:06d}.seg")
+
+def segment_paths(directory):
+    """Segment files of every writer process"""
+    return sorted(glob.glob(os.path.join(directory, SEGMENT_PATTERN)))
+
+def read_segment(path):
+    """Memory-map a segment (ignoring a trailing partial record)"""
+    count = os.path.getsize(path) // DECISION_DTYPE.itemsize
+    if count == 0:
+        return np.empty(0, dtype=DECISION_DTYPE)
+    return np.memmap(path, dtype=DECISION_DTYPE, mode='r', shape=(count,))
+
+def read_decisions(directory, start=None, end=None):
+    """
+    Decisions with start <= decided_at < end (Unix timestamps) from every
+    segment. Records are not assumed to be in time order: each segment's
+    decided_at column is filtered as a whole.
+    """
+    parts = []
+    for path in segment_paths(directory):
+        records = read_segment(path)
+        if len(records) == 0:
+            continue
+        mask = np.ones(len(records), dtype=bool)
+        if start is not None:
+            mask &= records['decided_at'] >= start
+        if end is not None:
+            mask &= records['decided_at'] < end
+        parts.append(np.asarray(records[mask]))
+    if not parts:
+        return np.empty(0, dtype=DECISION_DTYPE)
+    return np.concatenate(parts)
+
+def aggregate_by_rule(records):
+    """Per-rule decision counts, amounts and latency percentiles"""
+    summary = {}
+    codes, inverse = np.unique(records['rule'], return_inverse=True)
+    for i, code in enumerate(codes):
+        selected = records[inverse == i]
+        summary[rule_name(int(code)) or 'approved'] = {
+            "decisions": int(len(selected)),
+            "amount": float(selected['amount'].sum()),
+            "latency_p50_us": float(np.percentile(selected['latency_us'], 50)),
+            "latency_p99_us": float(np.percentile(selected['latency_us'], 99)),
+        }
+    return summary
+
+decision_log = DecisionLog(settings.decision_log_dir, settings.decision_log_segment_records,
+                           settings.decision_log_queue_size)
@@ -0,0 +1,95 @@
+"""
+Entity-link index.
+Union-find over users, card hashes and devices: every approved transaction
+links its user, card and device. A chargeback blocks the user's whole linked
+cluster, and checking a transaction is a couple of near-constant-time finds.
+"""
+
+USER = 'u'
+CARD = 'c'
+DEVICE = 'd'
+
+class EntityLinkIndex:
+    """
+    Incrementally maintained union-find with blocked clusters.
+    Unions that would grow a cluster beyond `max_cluster_size` are skipped,
+    so widely shared identifiers (e.g. a masked card number) cannot chain
+    unrelated users into one huge cluster.
+    """
+
+    def __init__(self, max_cluster_size: int = 50):
+        self.max_cluster_size = max_cluster_size
+        self._parent = {}
+        self._size = {}
+        self._blocked = set()
+        self.skipped_unions = 0
+
+    def find(self, node):
+        """Root of node's cluster (path halving); the node is created if missing"""
+        parent = self._parent
+        if node not in parent:
+            parent[node] = node
+            self._size[node] = 1
+            return node
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    def union(self, a, b):
+        """Merge the clusters of a and b; returns False if the size limit prevents it"""
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return True
+        if self.max_cluster_size and self._size[ra] + self._size[rb] > self.max_cluster_size:
+            self.skipped_unions += 1
+            return False
+        if self._size[ra] < self._size[rb]:
+            ra, rb = rb, ra
+        self._parent[rb] = ra
+        self._size[ra] += self._size.pop(rb)
+        if rb in self._blocked:
+            self._blocked.discard(rb)
+            self._blocked.add(ra)
+        return True
+
+    def link(self, user_id, card_hash=None, device_id=None):
+        """Link a user with the card and device of an approved transaction"""
+        user = (USER, user_id)
+        if card_hash is not None:
+            self.union(user, (CARD, card_hash))
+        if device_id is not None:
+            self.union(user, (DEVICE, device_id))
+
+    def block(self, user_id):
+        """Block the user's cluster; returns the cluster size"""
+        root = self.find((USER, user_id))
+        self._blocked.add(root)
+        return self._size[root]
+
+    def is_blocked(self, user_id, card_hash=None, device_id=None):
+        """True if the user, card or device belongs to a blocked cluster"""
+        if not self._blocked:
+            return False
+        for node in ((USER, user_id), (CARD, card_hash), (DEVICE, device_id)):
+            if node[1] is not None and node in self._parent and self.find(node) in self._blocked:
+                return True
+        return False
+
+    def cluster_size(self, user_id):
+        node = (USER, user_id)
+        return self._size[self.find(node)] if node in self._parent else 1
+
+    def clear(self):
+        self._parent.clear()
+        self._size.clear()
+        self._blocked.clear()
+        self.skipped_unions = 0
+
+    def stats(self):
+        return {
+            "nodes": len(self._parent),
+            "clusters": len(self._size),
+            "blocked_clusters": len(self._blocked),
+            "skipped_unions": self.skipped_unions,
+        }
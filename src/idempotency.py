@@ -0,0 +1,73 @@
+"""
+Idempotency layer for retried transactions.
+Recent decisions are kept in a bounded LRU cache with TTL, backed by the
+persisted `decisions` table, so a retried transaction_id gets its original
+recommendation back without being evaluated again.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from src.settings import settings
+
+class DecisionCache:
+    """Thread-safe LRU cache of transaction_id -> recommendation with TTL"""
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, transaction_id):
+        """Return cached recommendation or None if missing/expired"""
+        with self._lock:
+            entry = self._entries.get(transaction_id)
+            if entry is None:
+                return None
+            recommendation, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[transaction_id]
+                return None
+            self._entries.move_to_end(transaction_id)
+            return recommendation
+
+    def put(self, transaction_id, recommendation):
+        """Store recommendation, evicting the least recently used entries"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[transaction_id] = (recommendation, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(transaction_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+def load_decision(cur, transaction_id):
+    """
+    Return persisted recommendation for transaction_id or None.
+    Transactions stored without a decision row (loaded by scripts/load_csv.py
+    or approved before decisions were recorded) count as approved.
+    """
+    cur.execute("SELECT recommendation FROM decisions WHERE transaction_id = ?", (transaction_id,))
+    row = cur.fetchone()
+    if row:
+        return row[0]
+    cur.execute("SELECT 1 FROM transactions WHERE transaction_id = ?", (transaction_id,))
+    return 'approve' if cur.fetchone() else None
+
+def save_decision(cur, transaction_id, recommendation, decided_at):
+    """Persist recommendation (first decision wins)"""
+    cur.execute("""
+        INSERT OR IGNORE INTO decisions (transaction_id, recommendation, decided_at)
+        VALUES (?, ?, ?)
+    """, (transaction_id, recommendation, decided_at))
+
+decision_cache = DecisionCache(settings.idempotency_cache_size, settings.idempotency_ttl_seconds)
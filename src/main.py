@@ -1,8 +1,23 @@
 # main.py
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from starlette.datastructures import Headers, QueryParams
 from src.models import Transaction, Recommendation
 from src.antifraud import check_antifraud
+from src import database
 from src.database import init_db
+from src.state import get_window_state, start_state_sync
+from src.shadow import shadow
+from src.scoring import get_risk_scorer
+from src.decision_log import decision_log, RULE_SHED_OVERLOAD, RULE_SHED_DEADLINE
+from src.admission import (
+    admission, deadline, remaining, claim_shed, DeadlineExceeded, SHED_OVERLOAD, SHED_DEADLINE
+)
+from src.profiling import is_admin, start_request_profile, span, format_server_timing, sampler
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from src.settings import settings
 import logging
 
@@ -13,19 +28,80 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app):
+    """Load in-memory state and the risk model at startup so no request pays for it"""
+    get_risk_scorer()
+    state = get_window_state()
+    if not settings.state_address:
+        # With several workers the state owner process runs the sync
+        start_state_sync(state, database.DB_FILE, settings.state_sync_interval_seconds)
+    shadow.preload()
+    yield
+
 # Create FastAPI application
 app = FastAPI(
     title=settings.api_title,
     version=settings.api_version,
     description="Anti-fraud system for real-time suspicious transaction detection",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
 # Initialize database
 init_db()
 logger.info(f"API {settings.api_title} v{settings.api_version} started")
 
+class ProfilingMiddleware:
+    """
+    Capture a per-request span breakdown when an admin asks for it.
+    Pure ASGI: requests without a profile header or flag go straight to the app.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not _wants_profile(scope):
+            await self.app(scope, receive, send)
+            return
+        
+        spans = start_request_profile()
+        start = time.perf_counter()
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                total = time.perf_counter() - start
+                handler = sum(seconds for name, seconds in spans if name == 'handler')
+                spans.append(('validation_and_framework', total - handler))
+                spans.append(('total', total))
+                timing = format_server_timing(spans)
+                message = {**message, "headers": [*message.get("headers", []), (b"server-timing", timing.encode())]}
+                logger.info(f"PROFILE {scope['method']} {scope['path']}: {timing}")
+            await send(message)
+        
+        await self.app(scope, receive, send_with_timing)
+
+PROFILE_FLAG_VALUES = {"1", "true", "yes", "on"}
+
+def _wants_profile(scope):
+    # Cheap byte checks first so unprofiled requests pay almost nothing
+    query = scope.get("query_string", b"")
+    wants = b"profile=" in query and _is_set(QueryParams(query).get("profile"))
+    if not wants:
+        wants = any(name == b"x-profile" and _is_set(value.decode("latin-1")) for name, value in scope["headers"])
+    return wants and is_admin(Headers(scope=scope).get("x-admin-token"))
+
+def _is_set(flag):
+    return flag is not None and flag.strip().lower() in PROFILE_FLAG_VALUES
+
+app.add_middleware(ProfilingMiddleware)
+
+def require_admin(x_admin_token: str | None):
+    if not is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
 @app.get("/")
 def root():
     """Root endpoint with API information"""
@@ -36,7 +112,10 @@ def root():
         "endpoints": {
             "antifraud": "/antifraud",
             "docs": "/docs",
-            "health": "/health"
+            "health": "/health",
+            "shadow": "/shadow/stats",
+            "admission": "/admission/stats",
+            "decision_log": "/decision-log/stats"
         }
     }
 
@@ -45,8 +124,13 @@ def health():
     """Health check endpoint"""
     return {"status": "healthy"}
 
+@app.get("/shadow/stats")
+def shadow_stats():
+    """Shadow rule evaluation counters (enqueued, dropped, disagreements)"""
+    return shadow.stats()
+
 @app.post("/antifraud", response_model=Recommendation)
-def antifraud(txn: Transaction):
+async def antifraud(txn: Transaction, response: Response):
     """
     Analyze a transaction and return recommendation (approve/deny).
     
@@ -54,10 +138,101 @@ def antifraud(txn: Transaction):
     - Deny if user has chargeback history
     - Deny if >3 transactions in 2 minutes
     - Deny if total amount in last 24h exceeds R$1,000
+    
+    Admission control: when too many decisions are in flight or the decision
+    misses its deadline, the fail-open/fail-closed recommendation is returned.
     """
-    try:
-        recommendation = check_antifraud(txn)
-        return {"transaction_id": txn.transaction_id, "recommendation": recommendation}
-    except Exception as e:
-        logger.error(f"Error processing transaction {txn.transaction_id}: {e}")
-        raise HTTPException(status_code=500, detail="Internal error processing transaction")
+    start = time.perf_counter()
+    if not admission.try_acquire():
+        return _shed(txn, response, SHED_OVERLOAD, start)
+    
+    with deadline(admission.deadline_seconds):
+        # The slot is held until the worker thread really finishes
+        decision = asyncio.ensure_future(run_in_threadpool(_decide, txn))
+        decision.add_done_callback(_decision_finished)
+        try:
+            try:
+                recommendation = await asyncio.wait_for(asyncio.shield(decision), remaining())
+            except asyncio.TimeoutError:
+                if claim_shed():
+                    raise
+                # The worker is already storing its decision: that is the answer
+                recommendation = await decision
+        except (asyncio.TimeoutError, DeadlineExceeded):
+            admission.record_deadline_miss()
+            return _shed(txn, response, SHED_DEADLINE, start)
+        except Exception as e:
+            logger.error(f"Error processing transaction {txn.transaction_id}: {e}")
+            raise HTTPException(status_code=500, detail="Internal error processing transaction")
+    
+    return {"transaction_id": txn.transaction_id, "recommendation": recommendation}
+
+def _decision_finished(decision):
+    admission.release()
+    # Consume the error of a decision that finished after its request was shed
+    if not decision.cancelled():
+        decision.exception()
+
+def _decide(txn):
+    with span('handler'):
+        return check_antifraud(txn)
+
+def _shed(txn, response, reason, start):
+    recommendation = admission.fallback_recommendation
+    rule = RULE_SHED_OVERLOAD if reason == SHED_OVERLOAD else RULE_SHED_DEADLINE
+    decision_log.record(txn, recommendation, rule, time.perf_counter() - start)
+    logger.warning(f"SHED ({reason}): transaction {txn.transaction_id} -> {recommendation} (fail-{admission.fail_policy})")
+    response.headers["X-Antifraud-Shed"] = reason
+    return {"transaction_id": txn.transaction_id, "recommendation": recommendation}
+
+@app.get("/decision-log/stats")
+def decision_log_stats():
+    """Decision log writer counters (written, dropped)"""
+    return decision_log.stats()
+
+@app.get("/admission/stats")
+def admission_stats():
+    """In-flight decisions and shed counts (overload, deadline)"""
+    return admission.stats()
+
+@app.post("/admin/profiler/start")
+def profiler_start(interval_ms: float = 10.0, duration_s: float | None = None, include_idle: bool = False,
+                   x_admin_token: str | None = Header(None)):
+    """Start the sampling profiler (optionally for a fixed time window, idle threads skipped by default)"""
+    require_admin(x_admin_token)
+    if interval_ms <= 0:
+        raise HTTPException(status_code=400, detail="interval_ms must be positive")
+    if not sampler.start(interval_ms / 1000, duration_s, include_idle):
+        raise HTTPException(status_code=409, detail="Profiler already running")
+    return sampler.status()
+
+@app.post("/admin/profiler/stop")
+def profiler_stop(x_admin_token: str | None = Header(None)):
+    """Stop the sampling profiler"""
+    require_admin(x_admin_token)
+    sampler.stop()
+    return sampler.status()
+
+@app.get("/admin/profiler")
+def profiler_status(x_admin_token: str | None = Header(None)):
+    """Sampling profiler status"""
+    require_admin(x_admin_token)
+    return sampler.status()
+
+@app.get("/admin/profiler/folded", response_class=PlainTextResponse)
+def profiler_folded(x_admin_token: str | None = Header(None)):
+    """Aggregated stacks of the last sampling window in folded (flame graph) format"""
+    require_admin(x_admin_token)
+    return sampler.folded()
+
+@app.post("/admin/state/sync")
+def state_sync(x_admin_token: str | None = Header(None)):
+    """Pick up transactions and chargebacks written to the database by other processes"""
+    require_admin(x_admin_token)
+    return get_window_state().sync_from_db(database.DB_FILE)
+
+@app.post("/admin/entity-links/rebuild")
+def entity_links_rebuild(x_admin_token: str | None = Header(None)):
+    """Rebuild the card/device entity-link index from the transactions table"""
+    require_admin(x_admin_token)
+    return get_window_state().rebuild_links(database.DB_FILE)
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, field_validator
-from datetime import datetime
+from datetime import datetime, timezone
 import hashlib
 import re
 
@@ -7,12 +7,17 @@ def hash_card(card_number: str) -> str:
     """Hash card number for PCI-DSS security"""
     return hashlib.sha256(card_number.encode()).hexdigest()
 
+def parse_transaction_date(value: str) -> datetime:
+    """Parse an ISO transaction date; dates without a UTC offset are taken as UTC"""
+    dt = datetime.fromisoformat(value)
+    return dt if dt.tzinfo is not None else dt.replace(tzinfo=timezone.utc)
+
 class Transaction(BaseModel):
     transaction_id: int = Field(..., gt=0, description="Unique transaction ID")
     merchant_id: int = Field(..., gt=0, description="Merchant ID")
     user_id: int = Field(..., gt=0, description="User ID")
     card_number: str = Field(..., min_length=16, max_length=19, description="Card number (can be masked)")
-    transaction_date: str = Field(..., description="Transaction date in ISO format")
+    transaction_date: str = Field(..., description="Transaction date in ISO format, UTC unless it has an offset")
     transaction_amount: float = Field(..., gt=0, description="Transaction amount")
     device_id: int | None = Field(None, description="Device ID")
     
@@ -56,7 +61,17 @@ class Transaction(BaseModel):
     def get_card_hash(self) -> str:
         """Return hash of card number"""
         return hash_card(self.card_number)
+    
+    def is_card_masked(self) -> bool:
+        """True for masked numbers (BIN + last 4), which many cardholders share"""
+        return '*' in self.card_number
 
 class Recommendation(BaseModel):
     transaction_id: int
     recommendation: str = Field(..., pattern="^(approve|deny)$")
+
+class RuleSet(BaseModel):
+    """Thresholds of a candidate rule configuration evaluated in shadow mode"""
+    name: str = Field(..., min_length=1, description="Rule set name")
+    max_transactions_per_2min: int = Field(3, ge=0, description="Max transactions allowed in 2 minutes")
+    max_amount_per_24h: float = Field(1000.0, gt=0, description="Max amount allowed in 24 hours")
@@ -0,0 +1,159 @@
+"""
+On-demand profiling.
+- Per-request span breakdown: when a profile is active for the current request,
+  `span(name)` records how long each stage takes (reported as Server-Timing).
+- Statistical sampling profiler: samples every thread's stack at a fixed
+  interval and aggregates folded stacks (flame-graph compatible).
+"""
+
+import hmac
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from src.settings import settings
+
+_active_profile: ContextVar[list | None] = ContextVar('active_profile', default=None)
+
+def is_admin(token: str | None) -> bool:
+    """Return True if token matches the configured admin token"""
+    if not settings.admin_token or not token:
+        return False
+    return hmac.compare_digest(token, settings.admin_token)
+
+def start_request_profile():
+    """Activate span recording for the current context and return the span list"""
+    spans = []
+    _active_profile.set(spans)
+    return spans
+
+@contextmanager
+def span(name: str):
+    """Time a stage of the current request if it is being profiled"""
+    spans = _active_profile.get()
+    if spans is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spans.append((name, time.perf_counter() - start))
+
+def format_server_timing(spans) -> str:
+    """Format (name, seconds) spans as a Server-Timing header value (ms)"""
+    return ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in spans)
+
+# Frames a thread sits in while waiting for work (queue/event loop), and the
+# stdlib modules that may wrap them at the top of an idle stack
+_IDLE_FRAMES = {('queue.py', 'get'), ('selectors.py', 'select')}
+_WAIT_MODULES = {'threading.py', 'queue.py', 'selectors.py'}
+
+def _is_idle(frame) -> bool:
+    """True if the thread is blocked waiting for work rather than doing it"""
+    while frame is not None:
+        key = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+        if key in _IDLE_FRAMES:
+            return True
+        if key[0] not in _WAIT_MODULES:
+            return False
+        frame = frame.f_back
+    return False
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """Samples the stacks of all threads and aggregates them as folded stacks"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stacks = Counter()
+        self.samples = 0
+        self.interval = 0.0
+        self.include_idle = False
+        self.started_at = None
+        self.stopped_at = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, duration: float | None = None, include_idle: bool = False):
+        """
+        Start sampling every `interval` seconds, optionally for `duration` seconds.
+        Threads idling on a queue or event loop are skipped unless `include_idle`.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            self.stacks = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.include_idle = include_idle
+            self.started_at = time.time()
+            self.stopped_at = None
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(interval, duration), name="sampling-profiler", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling and wait for the sampler thread to exit"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def sample(self):
+        """Take one sample of every other thread's stack"""
+        own = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or (not self.include_idle and _is_idle(frame)):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            with self._data_lock:
+                self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def folded(self) -> str:
+        """Return aggregated stacks in folded format (`frame;frame;frame count`)"""
+        with self._data_lock:
+            stacks = self.stacks.most_common()
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def status(self):
+        return {
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "include_idle": self.include_idle,
+            "samples": self.samples,
+            "unique_stacks": len(self.stacks),
+            "started_at": self.started_at,
+            "stopped_at": self.stopped_at,
+        }
+
+    def _run(self, interval, duration):
+        deadline = time.monotonic() + duration if duration else None
+        while not self._stop.wait(interval):
+            self.sample()
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+        self.stopped_at = time.time()
+
+sampler = SamplingProfiler()
@@ -0,0 +1,165 @@
+"""
+Risk scoring.
+A logistic model over window features, trained offline
+(scripts/train_risk_model.py) and stored as a compact .npz weight file.
+Inference is pure NumPy; concurrent requests are scored together in one
+matrix product by BatchScorer.
+"""
+
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from src.settings import settings
+
+logger = logging.getLogger(__name__)
+
+RULE_RISK_SCORE = 'risk_score'
+
+FEATURES = [
+    'log_amount',
+    'count_recent',
+    'count_day',
+    'log_total_day',
+    'amount_ratio',
+    'distinct_devices',
+    'distinct_cards',
+    'device_changed',
+]
+
+def build_features(amount, check) -> list[float]:
+    """Feature vector for a transaction from its WindowCheck (before it is recorded)"""
+    mean_day = check.total_day / check.count_day if check.count_day else 0.0
+    return [
+        math.log1p(amount),
+        float(check.count_recent),
+        float(check.count_day),
+        math.log1p(check.total_day),
+        amount / mean_day if mean_day else 1.0,
+        float(check.distinct_devices),
+        float(check.distinct_cards),
+        1.0 if check.device_changed else 0.0,
+    ]
+
+class RiskModel:
+    """Standardized logistic regression: p = sigmoid(((x - mean) / scale) . w + b)"""
+
+    def __init__(self, weights, bias, mean, scale, threshold=0.5, features=FEATURES):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.threshold = float(threshold)
+        self.features = list(features)
+        if len(self.features) != len(self.weights):
+            raise ValueError('Model weights do not match its feature list')
+        if self.mean.shape != self.weights.shape or self.scale.shape != self.weights.shape:
+            raise ValueError('Model mean and scale do not match its weights')
+
+    def predict(self, X) -> np.ndarray:
+        """Fraud probability for each row of X (n_samples x n_features)"""
+        z = ((np.asarray(X, dtype=np.float64) - self.mean) / self.scale) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-z))
+
+    def save(self, path):
+        np.savez(path, weights=self.weights, bias=self.bias, mean=self.mean, scale=self.scale,
+                 threshold=self.threshold, features=np.array(self.features))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            features = [str(f) for f in data['features']]
+            if features != FEATURES:
+                raise ValueError(f'Model features {features} do not match {FEATURES}')
+            return cls(data['weights'], data['bias'], data['mean'], data['scale'],
+                       data['threshold'], features)
+
+class _Pending:
+    __slots__ = ('features', 'score', 'error')
+
+    def __init__(self, features):
+        self.features = features
+        self.score = None
+        self.error = None
+
+class BatchScorer:
+    """
+    Scores concurrent requests in batches. The first caller becomes the
+    leader, optionally waits `max_wait` seconds for more callers, then scores
+    everything pending in one NumPy call; callers arriving meanwhile form the
+    next batch. With max_wait=0 no latency is added.
+    """
+
+    def __init__(self, model, max_wait=0.0):
+        self.model = model
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._pending = []
+        self._leader = False
+        self.batches = 0
+        self.scored = 0
+
+    def score(self, features) -> float:
+        item = _Pending(features)
+        with self._cond:
+            self._pending.append(item)
+            while item.score is None and item.error is None and self._leader:
+                self._cond.wait()
+            if item.error is not None:
+                raise item.error
+            if item.score is not None:
+                return item.score
+            self._leader = True
+
+        if self.max_wait:
+            time.sleep(self.max_wait)
+
+        with self._cond:
+            batch, self._pending = self._pending, []
+        try:
+            scores = self.model.predict([p.features for p in batch])
+            for p, s in zip(batch, scores):
+                p.score = float(s)
+        except Exception as e:
+            for p in batch:
+                p.error = e
+        finally:
+            with self._cond:
+                self._leader = False
+                self.batches += 1
+                self.scored += len(batch)
+                self._cond.notify_all()
+
+        if item.error is not None:
+            raise item.error
+        return item.score
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+def get_risk_scorer():
+    """
+    Return the BatchScorer for the configured model, or None if scoring is
+    disabled. Called at startup so a missing or invalid model fails fast.
+    """
+    global _scorer
+    if not settings.risk_model_path:
+        return None
+    if _scorer is None:
+        with _scorer_lock:
+            if _scorer is None:
+                model = RiskModel.load(settings.risk_model_path)
+                if settings.risk_score_threshold is not None:
+                    model.threshold = settings.risk_score_threshold
+                _scorer = BatchScorer(model, settings.risk_batch_wait_us / 1e6)
+                logger.info(f"Risk model loaded from {settings.risk_model_path} (threshold {model.threshold})")
+    return _scorer
+
+def reset_risk_scorer():
+    """Drop the loaded model so it is reloaded on next use"""
+    global _scorer
+    with _scorer_lock:
+        _scorer = None
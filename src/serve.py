@@ -0,0 +1,33 @@
+"""
+Multi-worker entrypoint.
+Starts the local window state-owner process and then uvicorn with
+`settings.workers` workers, all sharing the same per-user state.
+
+Usage: python -m src.serve
+"""
+
+import os
+import tempfile
+
+import uvicorn
+
+from src.database import init_db
+from src.settings import settings
+from src.state import start_state_owner
+
+# Kept referenced for the life of the process: dropping the manager stops the owner
+_state_owner = None
+
+def main():
+    global _state_owner
+    init_db()
+    if settings.workers > 1 and not settings.state_address:
+        address = os.path.join(tempfile.gettempdir(), f"antifraud-state-{os.getpid()}.sock")
+        _state_owner = start_state_owner(address, settings.state_authkey)
+        # Workers read STATE_ADDRESS from the environment they inherit
+        os.environ['STATE_ADDRESS'] = address
+    
+    uvicorn.run("src.main:app", host=settings.api_host, port=settings.api_port, workers=settings.workers)
+
+if __name__ == "__main__":
+    main()
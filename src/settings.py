@@ -3,7 +3,9 @@ Anti-fraud system settings.
 Settings can be overridden via environment variables.
 """
 
+from typing import Literal
 from pydantic_settings import BaseSettings, SettingsConfigDict
+from src.models import RuleSet
 
 class Settings(BaseSettings):
     """Application settings"""
@@ -13,14 +15,48 @@ class Settings(BaseSettings):
     max_transactions_per_2min: int = 3
     max_amount_per_24h: float = 1000.0
     max_transaction_amount: float = 1000000.0
+    max_event_lateness_seconds: float = 300.0
+    max_event_future_seconds: float = 300.0
+    max_distinct_devices_per_24h: int = 0
+    max_distinct_cards_per_24h: int = 0
+    sketch_bucket_seconds: float = 3600.0
+    sketch_precision: int = 7
+    
+    chargeback_propagation: bool = True
+    entity_link_max_cluster_size: int = 50
+    
+    risk_model_path: str | None = None
+    risk_score_threshold: float | None = None
+    risk_batch_wait_us: float = 0.0
+    
+    idempotency_cache_size: int = 100000
+    idempotency_ttl_seconds: float = 3600.0
+    
+    shadow_rule_sets: list[RuleSet] = []
+    shadow_queue_size: int = 10000
     
     api_host: str = '0.0.0.0'
     api_port: int = 8000
     api_title: str = 'Anti-Fraud API'
     api_version: str = '1.0.0'
+    workers: int = 1
+    
+    state_address: str | None = None
+    state_authkey: str = 'antifraud-state'
+    state_sync_interval_seconds: float = 30.0
     
     log_level: str = 'INFO'
     
+    decision_log_dir: str | None = None
+    decision_log_segment_records: int = 1000000
+    decision_log_queue_size: int = 100000
+    
+    admin_token: str | None = None
+    
+    admission_max_in_flight: int = 64
+    admission_deadline_ms: float = 1000.0
+    admission_fail_policy: Literal['open', 'closed'] = 'closed'
+    
     model_config = SettingsConfigDict(
         env_file='.env',
         env_file_encoding='utf-8',
@@ -0,0 +1,136 @@
+"""
+Shadow rule evaluation.
+Live decisions are queued (never blocking the request) and a background worker
+evaluates candidate rule sets against their own state, recording disagreements
+in the `shadow_disagreements` table for later analysis.
+"""
+
+import logging
+import queue
+import threading
+from datetime import datetime
+
+from src.database import get_db
+from src.settings import settings
+from src.state import get_candidate_state, RULE_CHARGEBACK, RULE_DUPLICATE
+
+logger = logging.getLogger(__name__)
+
+class CandidateState:
+    """Window state of one candidate rule set (transactions it would have approved)"""
+
+    def __init__(self, rule_set):
+        self.rule_set = rule_set
+
+    def load(self):
+        """Load the candidate's state now rather than on its first evaluation"""
+        get_candidate_state(self.rule_set.name)
+
+    def evaluate(self, transaction_id, user_id, dt, amount, prior_cbk):
+        """
+        Return (recommendation, rule) and record the transaction if approved,
+        or None if the candidate state already holds the transaction (it was
+        loaded from the database after the live decision was stored).
+        """
+        if prior_cbk:
+            return 'deny', RULE_CHARGEBACK
+
+        check = get_candidate_state(self.rule_set.name).check_and_add(
+            transaction_id, user_id, dt.timestamp(), amount,
+            self.rule_set.max_transactions_per_2min, self.rule_set.max_amount_per_24h
+        )
+        if check.rule == RULE_DUPLICATE:
+            return None
+        return ('approve', None) if check.rule is None else ('deny', check.rule)
+
+class ShadowEvaluator:
+    """Bounded queue plus background worker evaluating candidate rule sets"""
+
+    def __init__(self, rule_sets, queue_size):
+        self.candidates = [CandidateState(r) for r in rule_sets]
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._worker = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.evaluated = 0
+        self.disagreements = 0
+
+    @property
+    def enabled(self):
+        return bool(self.candidates)
+
+    def preload(self):
+        """Load every candidate state (at startup, before live decisions are queued)"""
+        for candidate in self.candidates:
+            candidate.load()
+
+    def submit(self, txn, dt, recommendation, rule, prior_cbk=False):
+        """Queue a live decision for shadow evaluation; drop it if the queue is full"""
+        if not self.enabled:
+            return False
+        self._ensure_worker()
+        item = (txn.transaction_id, txn.user_id, dt, txn.transaction_amount, recommendation, rule, prior_cbk)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def join(self):
+        """Block until every queued decision has been evaluated"""
+        self._queue.join()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "rule_sets": [c.rule_set.name for c in self.candidates],
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "evaluated": self.evaluated,
+            "disagreements": self.disagreements,
+        }
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self._evaluate(item)
+            except Exception as e:
+                logger.error(f"Shadow evaluation failed for transaction {item[0]}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _evaluate(self, item):
+        transaction_id, user_id, dt, amount, live_recommendation, live_rule, prior_cbk = item
+        rows = []
+        for candidate in self.candidates:
+            result = candidate.evaluate(transaction_id, user_id, dt, amount, prior_cbk)
+            if result is None:
+                continue
+            recommendation, rule = result
+            if recommendation != live_recommendation:
+                rows.append((candidate.rule_set.name, transaction_id, user_id, live_recommendation,
+                             recommendation, live_rule, rule, datetime.now().isoformat()))
+        self.evaluated += 1
+
+        if rows:
+            self.disagreements += len(rows)
+            with get_db() as conn:
+                conn.executemany("""
+                    INSERT OR REPLACE INTO shadow_disagreements VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, rows)
+                conn.commit()
+
+shadow = ShadowEvaluator(settings.shadow_rule_sets, settings.shadow_queue_size)
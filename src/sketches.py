@@ -0,0 +1,134 @@
+"""
+Cardinality sketches.
+HyperLogLog registers kept per time bucket in a fixed-size ring, giving
+approximate distinct counts over a sliding window with bounded memory.
+"""
+
+import hashlib
+import math
+
+_INVERSE_POWERS = [2.0 ** -r for r in range(65)]
+
+def _high_bits(n):
+    high = _HIGH_BITS.get(n)
+    if high is None:
+        high = _HIGH_BITS[n] = int.from_bytes(b'\x80' * n, 'big')
+    return high
+
+_HIGH_BITS = {}
+
+def _max_packed(x, y, high):
+    # Byte-wise max of packed registers (values < 128). For each byte,
+    # (x | 0x80) - y keeps its high bit iff x >= y and never borrows across
+    # bytes, which yields a mask selecting the larger value.
+    keep = ((((x | high) - y) & high) >> 7) * 0xFF
+    return (x & keep) | (y & ~keep)
+
+def merge_registers(a, b) -> bytearray:
+    """Element-wise max of two equal-length register arrays"""
+    n = len(a)
+    merged = _max_packed(int.from_bytes(a, 'big'), int.from_bytes(b, 'big'), _high_bits(n))
+    return bytearray(merged.to_bytes(n, 'big'))
+
+def hash64(value) -> int:
+    """Stable 64-bit hash of a value"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+class HyperLogLog:
+    """HyperLogLog with 2**p one-byte registers"""
+
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p: int = 7):
+        if not 4 <= p <= 16:
+            raise ValueError('HyperLogLog precision must be between 4 and 16')
+        self.p = p
+        self.registers = bytearray(1 << p)
+
+    def add(self, h: int):
+        """Add a 64-bit hash"""
+        index, rank = _index_and_rank(h, self.p)
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merge another sketch of the same precision into this one"""
+        self.registers = merge_registers(self.registers, other.registers)
+
+    def estimate(self) -> float:
+        return estimate(self.registers)
+
+def _index_and_rank(h, p):
+    rest_bits = 64 - p
+    rest = h & ((1 << rest_bits) - 1)
+    return h >> rest_bits, rest_bits - rest.bit_length() + 1
+
+def estimate(registers) -> float:
+    """Cardinality estimate of a register array (with small-range correction)"""
+    m = len(registers)
+    alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+    raw = alpha * m * m / sum(map(_INVERSE_POWERS.__getitem__, registers))
+    zeros = registers.count(0)
+    if raw <= 2.5 * m and zeros:
+        return m * math.log(m / zeros)
+    return raw
+
+class WindowedSketch:
+    """
+    Ring of per-bucket HyperLogLog sketches covering a sliding window.
+    Memory is fixed by the number of buckets and the precision; counts are
+    approximate at bucket granularity (the window may extend up to one
+    bucket further back). Items cannot be removed.
+    The merge of all buckets before the current one is cached, so an
+    estimate usually merges just two register arrays.
+    """
+
+    __slots__ = ('p', 'bucket_seconds', 'buckets', '_slots', '_closed')
+
+    def __init__(self, window_seconds: float, bucket_seconds: float, p: int = 7):
+        self.p = p
+        self.bucket_seconds = bucket_seconds
+        self.buckets = math.ceil(window_seconds / bucket_seconds) + 1
+        self._slots = [None] * self.buckets
+        self._closed = None
+
+    def add(self, ts: float, h: int):
+        """Add a hashed item observed at event time ts"""
+        bucket = int(ts // self.bucket_seconds)
+        i = bucket % self.buckets
+        slot = self._slots[i]
+        if slot is None or slot[0] < bucket:
+            slot = (bucket, HyperLogLog(self.p))
+            self._slots[i] = slot
+        elif slot[0] > bucket:
+            return  # older than the ring covers
+        slot[1].add(h)
+        if self._closed is not None and bucket < self._closed[0]:
+            self._closed = None
+
+    def estimate(self, ts: float, extra: int | None = None) -> float:
+        """Distinct items in the window ending at ts, optionally counting `extra` too"""
+        bucket = int(ts // self.bucket_seconds)
+        merged = self._closed_registers(bucket)
+        current = self._slots[bucket % self.buckets]
+        if current is not None and current[0] == bucket:
+            merged = merge_registers(merged, current[1].registers)
+        else:
+            merged = bytearray(merged)
+        if extra is not None:
+            index, rank = _index_and_rank(extra, self.p)
+            if rank > merged[index]:
+                merged[index] = rank
+        return estimate(merged)
+
+    def _closed_registers(self, bucket):
+        # Merged registers of the buckets in the window before `bucket`
+        if self._closed is None or self._closed[0] != bucket:
+            n = 1 << self.p
+            high = _high_bits(n)
+            merged = 0
+            for slot in self._slots:
+                if slot is not None and bucket - self.buckets < slot[0] < bucket:
+                    merged = _max_packed(merged, int.from_bytes(slot[1].registers, 'big'), high)
+            self._closed = (bucket, merged.to_bytes(n, 'big'))
+        return self._closed[1]
@@ -0,0 +1,536 @@
+"""
+In-memory window state shared by request workers.
+Holds each user's recent approved transactions (velocity and amount windows)
+and the chargeback blocklist, so rules are evaluated without going to disk.
+
+In a single process the state lives in-process. With several uvicorn workers
+one local state-owner process holds it and workers talk to it through a
+multiprocessing manager on a Unix socket (see `src.serve`).
+"""
+
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from datetime import datetime, timezone
+from multiprocessing.managers import BaseManager
+
+from src import database
+from src.models import parse_transaction_date
+from src.settings import settings
+from src.sketches import WindowedSketch, hash64
+from src.entity_links import EntityLinkIndex
+
+logger = logging.getLogger(__name__)
+
+RULE_CHARGEBACK = 'chargeback'
+RULE_LINKED_CHARGEBACK = 'linked_chargeback'
+RULE_VELOCITY = 'velocity'
+RULE_AMOUNT = 'amount'
+RULE_LATE = 'late_event'
+RULE_FUTURE = 'future_event'
+RULE_DUPLICATE = 'duplicate'
+RULE_DISTINCT_DEVICES = 'distinct_devices'
+RULE_DISTINCT_CARDS = 'distinct_cards'
+
+VELOCITY_WINDOW_SECONDS = 2 * 60
+AMOUNT_WINDOW_SECONDS = 24 * 60 * 60
+EVICT_EVERY_INSERTS = 10000
+
+# Result of evaluating the window rules; distinct counts include the current transaction
+WindowCheck = namedtuple('WindowCheck', [
+    'rule', 'count_recent', 'total_day', 'distinct_devices', 'distinct_cards', 'count_day', 'device_changed'
+], defaults=(0, False))
+
+class UserWindow:
+    """
+    A user's approved transactions kept sorted by event time, with running
+    totals of their amounts so window sums take two bisections. Appending in
+    event-time order is O(1); an out-of-order insert or a removal costs one
+    step per later transaction.
+    """
+
+    __slots__ = ('timestamps', 'amounts', 'totals', 'transaction_ids', 'ids', 'watermark', 'devices',
+                 'cards', 'last_device')
+
+    def __init__(self, bucket_seconds, precision):
+        self.timestamps = []
+        self.amounts = []
+        # totals[i] is the sum of amounts[:i] plus whatever was pruned since the last rebase
+        self.totals = [0.0]
+        self.transaction_ids = []
+        self.ids = {}
+        self.watermark = float('-inf')
+        self.devices = WindowedSketch(AMOUNT_WINDOW_SECONDS, bucket_seconds, precision)
+        self.cards = WindowedSketch(AMOUNT_WINDOW_SECONDS, bucket_seconds, precision)
+        self.last_device = None
+
+    def count(self, start, end):
+        """Number of transactions with start <= ts <= end"""
+        return bisect_right(self.timestamps, end) - bisect_left(self.timestamps, start)
+
+    def total(self, start, end):
+        """Sum of amounts of transactions with start <= ts <= end"""
+        lo = bisect_left(self.timestamps, start)
+        hi = bisect_right(self.timestamps, end)
+        return self.totals[hi] - self.totals[lo] if hi > lo else 0.0
+
+    def __contains__(self, transaction_id):
+        return transaction_id in self.ids
+
+    def insert(self, transaction_id, ts, amount, advance=True):
+        i = bisect_right(self.timestamps, ts)
+        self.timestamps.insert(i, ts)
+        self.amounts.insert(i, amount)
+        self.transaction_ids.insert(i, transaction_id)
+        self.ids[transaction_id] = ts
+        totals = self.totals
+        totals.insert(i + 1, totals[i] + amount)
+        for j in range(i + 2, len(totals)):
+            totals[j] += amount
+        if advance and ts > self.watermark:
+            self.watermark = ts
+
+    def remove(self, transaction_id):
+        ts = self.ids.pop(transaction_id, None)
+        if ts is None:
+            return
+        i = bisect_left(self.timestamps, ts)
+        while self.transaction_ids[i] != transaction_id:
+            i += 1
+        amount = self.amounts[i]
+        del self.timestamps[i], self.amounts[i], self.transaction_ids[i]
+        totals = self.totals
+        del totals[i + 1]
+        for j in range(i + 1, len(totals)):
+            totals[j] -= amount
+        if i == len(self.timestamps):
+            # The newest transaction went away: roll the watermark back
+            self.watermark = self.timestamps[-1] if self.timestamps else float('-inf')
+
+    def prune(self, before):
+        """Drop transactions older than `before`"""
+        i = bisect_left(self.timestamps, before)
+        if i:
+            for transaction_id in self.transaction_ids[:i]:
+                del self.ids[transaction_id]
+            del self.timestamps[:i], self.amounts[:i], self.transaction_ids[:i], self.totals[:i]
+            totals = self.totals
+            if totals[0] > totals[-1] - totals[0]:
+                # Rebase once the pruned amount outweighs the live one, so
+                # rounding error stays relative to the window and the cost
+                # is amortised over the prunes
+                base = totals[0]
+                self.totals = [t - base for t in totals]
+
+class WindowState:
+    """
+    Per-user event-time windows and chargeback blocklist.
+    Transactions are evaluated against [t-2min, t] and [t-24h, t] regardless
+    of arrival order, as long as they are at most `max_lateness` seconds
+    behind the newest transaction seen for the user (its watermark).
+    Events more than `max_future` seconds ahead of the wall clock are denied
+    before they can move the watermark.
+    """
+
+    def __init__(self, max_lateness=None, max_future=None):
+        self.max_lateness = settings.max_event_lateness_seconds if max_lateness is None else max_lateness
+        self.max_future = settings.max_event_future_seconds if max_future is None else max_future
+        self.sketch_bucket_seconds = settings.sketch_bucket_seconds
+        self.sketch_precision = settings.sketch_precision
+        self._lock = threading.Lock()
+        self._windows = {}
+        self._blocked = set()
+        self.links = EntityLinkIndex(settings.entity_link_max_cluster_size)
+        self.propagate_chargebacks = settings.chargeback_propagation
+        self._rebuild_links = None  # links made while rebuild_links runs
+        self._high_watermark = float('-inf')
+        self._inserts = 0
+
+    @property
+    def retention(self):
+        # Enough history for any admissible event to see its whole 24h window
+        return AMOUNT_WINDOW_SECONDS + self.max_lateness
+
+    def check_and_add(self, transaction_id, user_id, ts, amount, max_count, max_amount,
+                      device_id=None, card_hash=None, max_devices=0, max_cards=0, provisional=False,
+                      link_card=True):
+        """
+        Evaluate the window rules for a transaction and record it if approved.
+        Returns a WindowCheck whose rule is None when approved, or
+        RULE_DUPLICATE when the transaction_id is already recorded (a retry
+        racing its original request). Distinct device/card limits of 0
+        disable those rules.
+        Checking and recording happen atomically so concurrent workers cannot
+        both pass the same limit.
+        With `provisional`, an approved transaction only reserves its place in
+        the velocity/amount windows; sketches, device, watermark and entity
+        links are updated by `confirm` (or the reservation dropped by `remove`)
+        once a later stage such as the risk score has decided.
+        With `link_card` False (masked card numbers) the card counts toward
+        distinct cards but is not used as an entity link.
+        """
+        with self._lock:
+            window = self._windows.get(user_id)
+            if window is not None and transaction_id in window:
+                return WindowCheck(RULE_DUPLICATE, 0, 0.0, 0.0, 0.0)
+            if user_id in self._blocked:
+                return WindowCheck(RULE_CHARGEBACK, 0, 0.0, 0.0, 0.0)
+            if self.propagate_chargebacks and self.links.is_blocked(
+                    user_id, card_hash if link_card else None, device_id):
+                return WindowCheck(RULE_LINKED_CHARGEBACK, 0, 0.0, 0.0, 0.0)
+
+            if ts > time.time() + self.max_future:
+                return WindowCheck(RULE_FUTURE, 0, 0.0, 0.0, 0.0)
+
+            if window is None:
+                window = self._windows[user_id] = self._new_window()
+            elif ts < window.watermark - self.max_lateness:
+                return WindowCheck(RULE_LATE, 0, 0.0, 0.0, 0.0)
+
+            count_recent = window.count(ts - VELOCITY_WINDOW_SECONDS, ts)
+            total_day = window.total(ts - AMOUNT_WINDOW_SECONDS, ts)
+            device_hash = hash64(device_id) if device_id is not None else None
+            card = hash64(card_hash) if card_hash is not None else None
+            distinct_devices = window.devices.estimate(ts, device_hash)
+            distinct_cards = window.cards.estimate(ts, card)
+            count_day = window.count(ts - AMOUNT_WINDOW_SECONDS, ts)
+            device_changed = (device_hash is not None and window.last_device is not None
+                              and device_hash != window.last_device)
+
+            rule = None
+            if count_recent >= max_count:
+                rule = RULE_VELOCITY
+            elif total_day + amount > max_amount:
+                rule = RULE_AMOUNT
+            elif max_devices and round(distinct_devices) > max_devices:
+                rule = RULE_DISTINCT_DEVICES
+            elif max_cards and round(distinct_cards) > max_cards:
+                rule = RULE_DISTINCT_CARDS
+            elif provisional:
+                window.insert(transaction_id, ts, amount, advance=False)
+            else:
+                window.insert(transaction_id, ts, amount)
+                self._record(window, ts, device_hash, card)
+                self._link(user_id, card_hash if link_card else None, device_id)
+            return WindowCheck(rule, count_recent, total_day, distinct_devices, distinct_cards,
+                               count_day, device_changed)
+
+    def confirm(self, transaction_id, user_id, ts, device_id=None, card_hash=None, link_card=True):
+        """Finish recording a transaction added provisionally by check_and_add"""
+        with self._lock:
+            window = self._windows.get(user_id)
+            if window is None or transaction_id not in window:
+                return
+            if ts > window.watermark:
+                window.watermark = ts
+            self._record(window, ts,
+                         hash64(device_id) if device_id is not None else None,
+                         hash64(card_hash) if card_hash is not None else None)
+            self._link(user_id, card_hash if link_card else None, device_id)
+
+    def add(self, transaction_id, user_id, ts, amount, device_id=None, card_hash=None, link_card=True):
+        """Record an approved transaction without evaluating rules; returns False if already recorded"""
+        with self._lock:
+            window = self._windows.get(user_id)
+            if window is None:
+                window = self._windows[user_id] = self._new_window()
+            elif transaction_id in window:
+                return False
+            window.insert(transaction_id, ts, amount)
+            self._record(window, ts,
+                         hash64(device_id) if device_id is not None else None,
+                         hash64(card_hash) if card_hash is not None else None)
+            self._link(user_id, card_hash if link_card else None, device_id)
+            return True
+
+    def is_recorded(self, user_id, transaction_id):
+        """True if the transaction is recorded (or reserved) in the user's window"""
+        with self._lock:
+            window = self._windows.get(user_id)
+            return window is not None and transaction_id in window
+
+    def remove(self, user_id, transaction_id):
+        """
+        Forget a recorded transaction (e.g. when storing it failed).
+        Distinct-count sketches cannot forget items and keep it.
+        """
+        with self._lock:
+            window = self._windows.get(user_id)
+            if window is not None:
+                window.remove(transaction_id)
+
+    def block_user(self, user_id):
+        """Block a user and its linked cluster; returns the cluster size"""
+        with self._lock:
+            self._blocked.add(user_id)
+            return self.links.block(user_id)
+
+    def is_blocked(self, user_id, card_hash=None, device_id=None):
+        with self._lock:
+            if user_id in self._blocked:
+                return True
+            return self.propagate_chargebacks and self.links.is_blocked(user_id, card_hash, device_id)
+
+    def rebuild_links(self, db_file):
+        """
+        Bulk rebuild the entity-link index from the transactions table.
+        Links made by concurrent requests while the table is read are replayed
+        into the new index before it replaces the old one.
+        """
+        with self._lock:
+            self._rebuild_links = []
+        try:
+            links = EntityLinkIndex(self.links.max_cluster_size)
+            conn = sqlite3.connect(db_file)
+            try:
+                cur = conn.cursor()
+                cur.execute(_LINKS_QUERY)
+                for user_id, card_hash, device_id in cur:
+                    links.link(user_id, card_hash, device_id)
+                blocked = _chargeback_users(cur)
+            finally:
+                conn.close()
+
+            with self._lock:
+                for user_id, card_hash, device_id in self._rebuild_links:
+                    links.link(user_id, card_hash, device_id)
+                self._blocked |= blocked
+                for user_id in self._blocked:
+                    links.block(user_id)
+                self.links = links
+                stats = links.stats()
+        finally:
+            with self._lock:
+                self._rebuild_links = None
+        logger.info(f"Entity links rebuilt from {db_file}: {stats}")
+        return stats
+
+    def stats(self):
+        with self._lock:
+            return {
+                "users": len(self._windows),
+                "transactions": sum(len(w.timestamps) for w in self._windows.values()),
+                "blocked_users": len(self._blocked),
+                "entity_links": self.links.stats(),
+            }
+
+    def load_from_db(self, db_file):
+        """Rebuild windows and blocklist from the transactions/users tables"""
+        conn = sqlite3.connect(db_file)
+        try:
+            cur = conn.cursor()
+            loaded = self._add_stored(cur)
+            for user_id in _chargeback_users(cur):
+                self.block_user(user_id)
+        finally:
+            conn.close()
+        logger.info(f"Window state loaded from {db_file}: {loaded} transactions")
+
+    def sync_from_db(self, db_file):
+        """
+        Pick up transactions and chargebacks written to the database by other
+        processes (scripts/load_csv.py, update_cbk run elsewhere). Only
+        transactions inside the retention horizon are read; ones already
+        recorded are skipped. Returns what was added.
+        """
+        with self._lock:
+            horizon = self._high_watermark - self.retention
+            blocked = set(self._blocked)
+        since = None
+        if horizon != float('-inf'):
+            # A day of margin absorbs stored date format differences
+            since = datetime.fromtimestamp(horizon - AMOUNT_WINDOW_SECONDS, timezone.utc).replace(tzinfo=None).isoformat()
+
+        conn = sqlite3.connect(db_file)
+        try:
+            cur = conn.cursor()
+            added = self._add_stored(cur, since)
+            newly_blocked = _chargeback_users(cur) - blocked
+            for user_id in newly_blocked:
+                self.block_user(user_id)
+        finally:
+            conn.close()
+        if added or newly_blocked:
+            logger.info(f"Window state synced from {db_file}: {added} transactions, "
+                        f"{len(newly_blocked)} newly blocked users")
+        return {"transactions": added, "blocked_users": len(newly_blocked)}
+
+    def _add_stored(self, cur, since=None):
+        # Add stored transactions (dated at or after `since`) not recorded yet
+        query = """
+            SELECT t.transaction_id, t.user_id, t.transaction_date, t.transaction_amount, t.device_id,
+                   t.card_number, l.card_hash IS NOT NULL
+            FROM transactions t LEFT JOIN linkable_cards l ON l.card_hash = t.card_number
+        """
+        if since is None:
+            cur.execute(query + " ORDER BY t.transaction_date")
+        else:
+            cur.execute(query + " WHERE t.transaction_date >= ? ORDER BY t.transaction_date", (since,))
+        added = 0
+        for transaction_id, user_id, transaction_date, amount, device_id, card_hash, linkable in cur.fetchall():
+            try:
+                ts = parse_transaction_date(transaction_date).timestamp()
+            except (TypeError, ValueError):
+                continue
+            if self.add(transaction_id, user_id, ts, amount, device_id, card_hash, link_card=bool(linkable)):
+                added += 1
+        return added
+
+    def _link(self, user_id, card_hash, device_id):
+        # Called with the lock held
+        self.links.link(user_id, card_hash, device_id)
+        if self._rebuild_links is not None:
+            self._rebuild_links.append((user_id, card_hash, device_id))
+
+    def _new_window(self):
+        return UserWindow(self.sketch_bucket_seconds, self.sketch_precision)
+
+    def _record(self, window, ts, device_hash=None, card=None):
+        # Everything but the window arrays: sketches, device, pruning, eviction
+        if device_hash is not None:
+            window.devices.add(ts, device_hash)
+            window.last_device = device_hash
+        if card is not None:
+            window.cards.add(ts, card)
+        window.prune(window.watermark - self.retention)
+        if ts > self._high_watermark:
+            self._high_watermark = ts
+        self._inserts += 1
+        if self._inserts % EVICT_EVERY_INSERTS == 0:
+            self._evict_idle()
+
+    def _evict_idle(self):
+        # Users with nothing inside the retention horizon hold no useful state
+        horizon = self._high_watermark - self.retention
+        idle = [user_id for user_id, w in self._windows.items()
+                if w.watermark < horizon and not (w.timestamps and w.timestamps[-1] >= horizon)]
+        for user_id in idle:
+            del self._windows[user_id]
+
+# Masked card numbers (no linkable_cards row) are not used as links
+_LINKS_QUERY = """
+    SELECT t.user_id, l.card_hash, t.device_id
+    FROM transactions t LEFT JOIN linkable_cards l ON l.card_hash = t.card_number
+"""
+
+def _chargeback_users(cur):
+    cur.execute("""
+        SELECT user_id FROM users WHERE has_prior_cbk
+        UNION SELECT user_id FROM transactions WHERE has_cbk
+    """)
+    return {user_id for (user_id,) in cur}
+
+class StateManager(BaseManager):
+    """Multiprocessing manager serving the shared WindowState"""
+
+_owned_state = None
+_owned_candidates = {}
+
+def _get_owned_state():
+    # Runs in the state-owner process
+    global _owned_state
+    if _owned_state is None:
+        _owned_state = WindowState()
+        _owned_state.load_from_db(database.DB_FILE)
+        start_state_sync(_owned_state, database.DB_FILE, settings.state_sync_interval_seconds)
+    return _owned_state
+
+def _get_owned_candidate_state(name):
+    # Runs in the state-owner process
+    state = _owned_candidates.get(name)
+    if state is None:
+        state = _owned_candidates[name] = _loaded_state()
+    return state
+
+StateManager.register('get_state', callable=_get_owned_state)
+StateManager.register('get_candidate_state', callable=_get_owned_candidate_state)
+
+def start_state_sync(state, db_file, interval):
+    """
+    Sync `state` from the database every `interval` seconds in a background
+    thread (see WindowState.sync_from_db); 0 disables it.
+    """
+    if not interval:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                state.sync_from_db(db_file)
+            except Exception as e:
+                logger.error(f"Window state sync from {db_file} failed: {e}")
+
+    thread = threading.Thread(target=run, name="state-sync", daemon=True)
+    thread.start()
+    return thread
+
+def start_state_owner(address, authkey):
+    """
+    Start the state-owner process listening on `address` and return its
+    manager. The manager shuts the process down when it is garbage
+    collected, so callers must keep it referenced.
+    """
+    manager = StateManager(address=address, authkey=authkey.encode())
+    manager.start()
+    manager.get_state()  # load state before workers start
+    for rule_set in settings.shadow_rule_sets:
+        manager.get_candidate_state(rule_set.name)
+    logger.info(f"Window state owner listening on {address}")
+    return manager
+
+_state = None
+_candidates = {}
+_manager = None
+_state_lock = threading.Lock()
+
+def _loaded_state():
+    state = WindowState()
+    state.load_from_db(database.DB_FILE)
+    return state
+
+def _connect():
+    # Called with _state_lock held
+    global _manager
+    if _manager is None:
+        manager = StateManager(address=settings.state_address, authkey=settings.state_authkey.encode())
+        manager.connect()
+        _manager = manager
+    return _manager
+
+def get_window_state():
+    """Return the window state for this process (local or shared proxy)"""
+    global _state
+    if _state is None:
+        with _state_lock:
+            if _state is None:
+                _state = _connect().get_state() if settings.state_address else _loaded_state()
+    return _state
+
+def get_candidate_state(name):
+    """
+    Return the window state of a shadow rule set (local or shared proxy).
+    It starts from the stored transactions, like the live state, and in
+    multi-worker mode is shared so the candidate sees all of a user's traffic.
+    """
+    state = _candidates.get(name)
+    if state is None:
+        with _state_lock:
+            state = _candidates.get(name)
+            if state is None:
+                if settings.state_address:
+                    state = _connect().get_candidate_state(name)
+                else:
+                    state = _loaded_state()
+                _candidates[name] = state
+    return state
+
+def reset_window_state():
+    """Drop the process-local state so it is reloaded on next use"""
+    global _state
+    with _state_lock:
+        _state = None
+        _candidates.clear()
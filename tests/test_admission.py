@@ -0,0 +1,140 @@
+"""
+Unit tests for admission control.
+"""
+
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import database
+
+TEST_DB = 'test_admission.db'
+# Redirect before importing the app, which initializes the database on import
+database.DB_FILE = TEST_DB
+
+from src.admission import admission, deadline, check_deadline, DeadlineExceeded
+from src.database import init_db, get_db
+from src.idempotency import decision_cache
+from src.main import app
+from src.state import WindowState, get_window_state, reset_window_state
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database and admission settings"""
+    previous = (database.DB_FILE, admission.max_in_flight, admission.deadline_seconds, admission.fail_policy)
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    decision_cache.clear()
+    reset_window_state()
+    
+    yield
+    
+    database.DB_FILE, admission.max_in_flight, admission.deadline_seconds, admission.fail_policy = previous
+    reset_window_state()
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def transaction(transaction_id):
+    return {
+        "transaction_id": transaction_id,
+        "merchant_id": 12345,
+        "user_id": 20202,
+        "card_number": "434505******9116",
+        "transaction_date": datetime.now(timezone.utc).isoformat(),
+        "transaction_amount": 10.0,
+        "device_id": 12345
+    }
+
+def test_overload_is_shed_with_fallback():
+    """Test that requests beyond the in-flight limit get the fallback immediately"""
+    admission.max_in_flight = 1
+    admission.fail_policy = 'open'
+    shed_before = admission.stats()["shed"]["overload"]
+    
+    assert admission.try_acquire()
+    try:
+        response = client.post("/antifraud", json=transaction(9200001))
+    finally:
+        admission.release()
+    
+    assert response.json()["recommendation"] == "approve"
+    assert response.headers["X-Antifraud-Shed"] == "overload"
+    assert client.get("/admission/stats").json()["shed"]["overload"] == shed_before + 1
+    
+    response = client.post("/antifraud", json=transaction(9200001))
+    assert "X-Antifraud-Shed" not in response.headers
+
+def test_slow_database_misses_deadline():
+    """Test that a locked database yields the fail-closed answer within the deadline"""
+    admission.deadline_seconds = 0.2
+    admission.fail_policy = 'closed'
+    
+    blocker = sqlite3.connect(TEST_DB)
+    blocker.execute("BEGIN EXCLUSIVE")
+    try:
+        start = time.monotonic()
+        response = client.post("/antifraud", json=transaction(9200002))
+        elapsed = time.monotonic() - start
+    finally:
+        blocker.rollback()
+        blocker.close()
+    
+    assert response.json()["recommendation"] == "deny"
+    assert response.headers["X-Antifraud-Shed"] == "deadline"
+    assert elapsed < 1.0
+    
+    # Once the database recovers the transaction is decided normally
+    deadline_end = time.monotonic() + 2
+    while admission.stats()["in_flight"] and time.monotonic() < deadline_end:
+        time.sleep(0.01)
+    response = client.post("/antifraud", json=transaction(9200002))
+    assert response.json()["recommendation"] == "approve"
+
+def test_decision_finishing_after_shed_is_not_stored(monkeypatch):
+    """Test that a worker finishing after its request was shed stores nothing"""
+    admission.deadline_seconds = 0.2
+    admission.fail_policy = 'closed'
+    check_and_add = WindowState.check_and_add
+    
+    def slow_check_and_add(self, *args, **kwargs):
+        time.sleep(0.3)
+        return check_and_add(self, *args, **kwargs)
+    
+    monkeypatch.setattr(WindowState, 'check_and_add', slow_check_and_add)
+    # Short statements finish before the progress handler ever runs
+    monkeypatch.setattr(database, 'PROGRESS_CHECK_INSTRUCTIONS', 10 ** 9)
+    response = client.post("/antifraud", json=transaction(9200003))
+    assert response.json()["recommendation"] == "deny"
+    assert response.headers["X-Antifraud-Shed"] == "deadline"
+    
+    time.sleep(0.5)  # let the worker thread finish
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0] == 0
+    assert get_window_state().stats()["transactions"] == 0
+    
+    monkeypatch.setattr(WindowState, 'check_and_add', check_and_add)
+    response = client.post("/antifraud", json=transaction(9200003))
+    assert "X-Antifraud-Shed" not in response.headers
+
+def test_progress_handler_interrupts_after_deadline():
+    """Test that statements running past the deadline raise DeadlineExceeded"""
+    with deadline(0.05):
+        with pytest.raises(DeadlineExceeded):
+            with get_db() as conn:
+                conn.execute("""
+                    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n)
+                    SELECT COUNT(*) FROM n
+                """).fetchone()
+        with pytest.raises(DeadlineExceeded):
+            check_deadline()
+    
+    check_deadline()
@@ -4,7 +4,7 @@ Unit tests for the anti-fraud system.
 
 import pytest
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import sys
 from src import database
@@ -21,6 +21,10 @@ from fastapi.testclient import TestClient
 from src.main import app
 from src.database import init_db, get_db
 from src.antifraud import update_cbk
+from src.idempotency import DecisionCache, decision_cache
+from src.state import get_window_state, reset_window_state
+import threading
+import time
 
 client = TestClient(app)
 
@@ -33,6 +37,8 @@ def setup_db():
         os.remove(TEST_DB)
     
     init_db()
+    decision_cache.clear()
+    reset_window_state()
     
     yield
     
@@ -59,7 +65,7 @@ def test_approve_normal_transaction():
 def test_deny_high_amount_in_24h():
     """Test denial for high amount in 24h"""
     user_id = 88888
-    base_time = datetime.now()
+    base_time = datetime.now(timezone.utc)
     
     response1 = client.post("/antifraud", json={
         "transaction_id": 1000001,
@@ -86,7 +92,7 @@ def test_deny_high_amount_in_24h():
 def test_deny_many_transactions():
     """Test denial for many transactions in sequence"""
     user_id = 77777
-    base_time = datetime.now()
+    base_time = datetime.now(timezone.utc)
     
     for i in range(3):
         response = client.post("/antifraud", json={
@@ -114,7 +120,7 @@ def test_deny_many_transactions():
 def test_deny_prior_chargeback():
     """Test denial for prior chargeback"""
     user_id = 66666
-    base_time = datetime.now()
+    base_time = datetime.now(timezone.utc)
     
     response1 = client.post("/antifraud", json={
         "transaction_id": 3000001,
@@ -184,7 +190,7 @@ def test_negative_amount():
 def test_transactions_after_time_window():
     """Test that transactions outside time window are approved"""
     user_id = 44444
-    base_time = datetime.now()
+    base_time = datetime.now(timezone.utc)
     
     for i in range(3):
         response = client.post("/antifraud", json={
@@ -209,5 +215,150 @@ def test_transactions_after_time_window():
     })
     assert response4.json()["recommendation"] == "approve"
 
+def test_retried_approved_transaction_is_replayed():
+    """Test that a retried approved transaction gets the same recommendation"""
+    payload = {
+        "transaction_id": 6000001,
+        "merchant_id": 12345,
+        "user_id": 33333,
+        "card_number": "434505******9116",
+        "transaction_date": datetime.now(timezone.utc).isoformat(),
+        "transaction_amount": 100.0,
+        "device_id": 12345
+    }
+    
+    assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    
+    # Persisted decision survives a cold cache
+    decision_cache.clear()
+    assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    
+    with get_db() as conn:
+        count = conn.execute("SELECT COUNT(*) FROM transactions WHERE user_id = 33333").fetchone()[0]
+    assert count == 1
+
+def test_retries_do_not_count_toward_velocity():
+    """Test that retries of the same transaction are not counted as new transactions"""
+    user_id = 22222
+    base_time = datetime.now(timezone.utc)
+    payload = {
+        "transaction_id": 7000000,
+        "merchant_id": 12345,
+        "user_id": user_id,
+        "card_number": "434505******9116",
+        "transaction_date": base_time.isoformat(),
+        "transaction_amount": 50.0,
+        "device_id": 12345
+    }
+    
+    for _ in range(4):
+        assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    
+    response = client.post("/antifraud", json={
+        **payload,
+        "transaction_id": 7000001,
+        "transaction_date": (base_time + timedelta(seconds=10)).isoformat()
+    })
+    assert response.json()["recommendation"] == "approve"
+
+def test_retry_of_transaction_stored_without_decision_is_replayed():
+    """Test that rows inserted directly into transactions (e.g. load_csv.py) replay as approved"""
+    base_time = datetime.now(timezone.utc)
+    with get_db() as conn:
+        for i in range(3):
+            conn.execute(
+                "INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (8000000 + i, 1, 44444, 'hash', (base_time + timedelta(seconds=i)).isoformat(), 10.0, 1, False)
+            )
+        conn.commit()
+    
+    response = client.post("/antifraud", json={
+        "transaction_id": 8000002,
+        "merchant_id": 1,
+        "user_id": 44444,
+        "card_number": "434505******9116",
+        "transaction_date": (base_time + timedelta(seconds=2)).isoformat(),
+        "transaction_amount": 10.0,
+        "device_id": 1
+    })
+    assert response.json()["recommendation"] == "approve"
+    
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM decisions").fetchone()[0] == 0
+
+def test_retry_while_original_in_flight_replays_its_decision():
+    """Test that a retry racing its original is not counted against its own reservation"""
+    base_time = datetime.now(timezone.utc)
+    payload = {
+        "transaction_id": 8100001,
+        "merchant_id": 12345,
+        "user_id": 55555,
+        "card_number": "434505******9116",
+        "transaction_date": base_time.isoformat(),
+        "transaction_amount": 600.0,
+        "device_id": 12345
+    }
+    # The original has passed the rules and is about to store its approval
+    state = get_window_state()
+    assert state.check_and_add(8100001, 55555, base_time.timestamp(), 600.0, 3, 1000.0).rule is None
+    
+    def store_original():
+        time.sleep(0.1)
+        with get_db() as conn:
+            conn.execute("INSERT INTO transactions VALUES (8100001, 12345, 55555, 'hash', ?, 600.0, 12345, 0)",
+                         (base_time.isoformat(),))
+            conn.execute("INSERT INTO decisions VALUES (8100001, 'approve', ?)", (base_time.isoformat(),))
+            conn.commit()
+    
+    original = threading.Thread(target=store_original)
+    original.start()
+    response = client.post("/antifraud", json=payload)
+    original.join()
+    
+    assert response.json()["recommendation"] == "approve"
+    assert decision_cache.get(8100001) == "approve"
+
+def test_retry_after_original_gave_up_is_evaluated():
+    """Test that a retry is evaluated normally once the original dropped its reservation"""
+    base_time = datetime.now(timezone.utc)
+    state = get_window_state()
+    assert state.check_and_add(8100002, 55556, base_time.timestamp(), 600.0, 3, 1000.0).rule is None
+    
+    def fail_original():
+        time.sleep(0.05)
+        state.remove(55556, 8100002)
+    
+    original = threading.Thread(target=fail_original)
+    original.start()
+    response = client.post("/antifraud", json={
+        "transaction_id": 8100002,
+        "merchant_id": 12345,
+        "user_id": 55556,
+        "card_number": "434505******9116",
+        "transaction_date": base_time.isoformat(),
+        "transaction_amount": 600.0,
+        "device_id": 12345
+    })
+    original.join()
+    
+    assert response.json()["recommendation"] == "approve"
+
+def test_decision_cache_evicts_and_expires():
+    """Test LRU eviction and TTL expiry of the decision cache"""
+    cache = DecisionCache(max_size=2, ttl_seconds=60)
+    cache.put(1, 'approve')
+    cache.put(2, 'deny')
+    cache.get(1)
+    cache.put(3, 'approve')
+    
+    assert cache.get(2) is None
+    assert cache.get(1) == 'approve'
+    assert cache.get(3) == 'approve'
+    
+    expired = DecisionCache(max_size=2, ttl_seconds=-1)
+    expired.put(1, 'approve')
+    assert expired.get(1) is None
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,189 @@
+"""
+Unit tests for the append-only decision log.
+"""
+
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from src import database
+
+TEST_DB = 'test_decision_log.db'
+# Redirect before importing the app, which initializes the database on import
+database.DB_FILE = TEST_DB
+
+from src import antifraud, main
+from src.database import init_db
+from src.admission import admission
+from src.decision_log import (
+    DecisionLog, DECISION_DTYPE, read_decisions, aggregate_by_rule, segment_paths, rule_name,
+    RECOMMENDATION_CODES
+)
+from src.idempotency import decision_cache
+from src.state import reset_window_state
+
+client = TestClient(main.app)
+
+class Txn:
+    def __init__(self, transaction_id, user_id=1, amount=10.0, transaction_date='2024-01-01T10:00:00'):
+        self.transaction_id = transaction_id
+        self.user_id = user_id
+        self.transaction_amount = amount
+        self.transaction_date = transaction_date
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database"""
+    previous = database.DB_FILE
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    decision_cache.clear()
+    reset_window_state()
+    
+    yield
+    
+    reset_window_state()
+    database.DB_FILE = previous
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def test_segments_rotate_and_append(tmp_path):
+    """Test that records are appended across fixed-size segments"""
+    log = DecisionLog(str(tmp_path), segment_records=4)
+    for i in range(10):
+        assert log.record(Txn(i), 'approve' if i % 2 else 'deny', None if i % 2 else 'velocity', 0.001)
+    log.flush()
+    
+    paths = segment_paths(str(tmp_path))
+    assert [os.path.getsize(p) // DECISION_DTYPE.itemsize for p in paths] == [4, 4, 2]
+    
+    records = read_decisions(str(tmp_path))
+    assert list(records['transaction_id']) == list(range(10))
+    assert records['latency_us'][0] == pytest.approx(1000)
+    assert records['event_time'][0] == datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    # A new writer continues the last segment
+    log = DecisionLog(str(tmp_path), segment_records=4)
+    log.record(Txn(10), 'approve', None, 0.001)
+    log.flush()
+    assert len(segment_paths(str(tmp_path))) == 3
+    assert len(read_decisions(str(tmp_path))) == 11
+
+def test_append_drops_partial_trailing_record(tmp_path):
+    """Test that a record cut short by a crash does not misalign later appends"""
+    log = DecisionLog(str(tmp_path), segment_records=10)
+    log.record(Txn(1), 'approve', None, 0.001)
+    log.flush()
+    path = segment_paths(str(tmp_path))[0]
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * (DECISION_DTYPE.itemsize // 2))
+    
+    log = DecisionLog(str(tmp_path), segment_records=10)
+    log.record(Txn(2), 'deny', 'velocity', 0.001)
+    log.flush()
+    
+    records = read_decisions(str(tmp_path))
+    assert list(records['transaction_id']) == [1, 2]
+    assert rule_name(int(records['rule'][1])) == 'velocity'
+
+def test_time_range_and_rule_aggregates(tmp_path):
+    """Test vectorized time-range filtering and per-rule aggregates"""
+    log = DecisionLog(str(tmp_path), segment_records=3)
+    log.record(Txn(1, amount=5.0), 'deny', 'amount', 0.002)
+    log.record(Txn(2, amount=7.0), 'deny', 'amount', 0.004)
+    log.flush()
+    middle = time.time()
+    time.sleep(0.01)
+    log.record(Txn(3, amount=1.0), 'approve', None, 0.001)
+    log.flush()
+    
+    assert list(read_decisions(str(tmp_path), start=middle)['transaction_id']) == [3]
+    assert list(read_decisions(str(tmp_path), end=middle)['transaction_id']) == [1, 2]
+    
+    summary = aggregate_by_rule(read_decisions(str(tmp_path)))
+    assert summary['amount']['decisions'] == 2
+    assert summary['amount']['amount'] == 12.0
+    assert summary['approved']['decisions'] == 1
+
+def test_time_range_does_not_assume_order(tmp_path):
+    """Test that records written out of time order are all filtered correctly"""
+    records = np.zeros(3, dtype=DECISION_DTYPE)
+    records['transaction_id'] = [1, 2, 3]
+    records['decided_at'] = [300.0, 100.0, 200.0]
+    records.tofile(str(tmp_path / 'decisions-1-000001.seg'))
+    
+    assert sorted(read_decisions(str(tmp_path), start=150, end=250)['transaction_id']) == [3]
+    assert sorted(read_decisions(str(tmp_path), end=150)['transaction_id']) == [2]
+
+def test_full_queue_drops_decisions(tmp_path):
+    """Test that a full queue drops records instead of blocking"""
+    log = DecisionLog(str(tmp_path), queue_size=1)
+    log._worker = object()  # keep the writer from draining the queue
+    
+    assert log.record(Txn(1), 'approve', None, 0.0)
+    assert not log.record(Txn(2), 'approve', None, 0.0)
+    assert log.stats()["dropped"] == 1
+
+def test_api_decisions_are_logged(tmp_path, monkeypatch):
+    """Test that approvals, denials and replays from /antifraud are all recorded"""
+    log = DecisionLog(str(tmp_path))
+    monkeypatch.setattr(antifraud, 'decision_log', log)
+    payload = {
+        "transaction_id": 9300001,
+        "merchant_id": 12345,
+        "user_id": 30303,
+        "card_number": "434505******9116",
+        "transaction_date": datetime.now(timezone.utc).isoformat(),
+        "transaction_amount": 600.0,
+        "device_id": 12345
+    }
+    client.post("/antifraud", json=payload)
+    client.post("/antifraud", json={**payload, "transaction_id": 9300002})
+    client.post("/antifraud", json=payload)
+    log.flush()
+    
+    records = read_decisions(str(tmp_path))
+    assert list(records['transaction_id']) == [9300001, 9300002, 9300001]
+    assert [rule_name(int(r)) for r in records['rule']] == [None, 'amount', 'replay']
+    assert list(records['recommendation']) == [RECOMMENDATION_CODES[r] for r in ('approve', 'deny', 'approve')]
+    assert np.all(records['latency_us'] > 0)
+
+def test_shed_request_is_logged_once(tmp_path, monkeypatch):
+    """Test that a decision finishing after its request was shed is not logged again"""
+    log = DecisionLog(str(tmp_path))
+    monkeypatch.setattr(antifraud, 'decision_log', log)
+    monkeypatch.setattr(main, 'decision_log', log)
+    payload = {
+        "transaction_id": 9300003,
+        "merchant_id": 12345,
+        "user_id": 30304,
+        "card_number": "434505******9116",
+        "transaction_date": datetime.now(timezone.utc).isoformat(),
+        "transaction_amount": 10.0,
+        "device_id": 12345
+    }
+    assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    
+    # A retry whose replay lookup outlives the deadline
+    decision_cache.clear()
+    load_decision = antifraud.load_decision
+    
+    def slow_load_decision(cur, transaction_id):
+        time.sleep(0.3)
+        return load_decision(cur, transaction_id)
+    
+    monkeypatch.setattr(antifraud, 'load_decision', slow_load_decision)
+    monkeypatch.setattr(admission, 'deadline_seconds', 0.2)
+    response = client.post("/antifraud", json=payload)
+    assert response.headers["X-Antifraud-Shed"] == "deadline"
+    time.sleep(0.5)  # let the worker thread finish
+    log.flush()
+    
+    records = read_decisions(str(tmp_path))
+    assert [rule_name(int(r)) for r in records['rule']] == [None, 'shed_deadline']
@@ -0,0 +1,132 @@
+"""
+Unit tests for the card/device entity-link index.
+"""
+
+import os
+from datetime import datetime
+
+import pytest
+
+from src import database
+from src.database import init_db, get_db
+from src.entity_links import EntityLinkIndex
+from src.state import WindowState, RULE_CHARGEBACK, RULE_LINKED_CHARGEBACK
+
+TEST_DB = 'test_entity_links.db'
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database"""
+    previous = database.DB_FILE
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    
+    yield
+    
+    database.DB_FILE = previous
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def test_chargeback_blocks_linked_cluster():
+    """Test that users sharing a card or device with a charged-back user are blocked"""
+    index = EntityLinkIndex()
+    index.link(1, card_hash='card-a', device_id=10)
+    index.link(2, card_hash='card-a', device_id=20)
+    index.link(3, card_hash='card-b', device_id=20)
+    index.link(4, card_hash='card-c', device_id=40)
+    
+    assert index.block(1) == 7
+    assert index.is_blocked(2)
+    assert index.is_blocked(3)
+    assert not index.is_blocked(4)
+    
+    # A new user presenting a blocked card is caught before being linked
+    assert index.is_blocked(5, card_hash='card-b')
+    assert not index.is_blocked(5, card_hash='card-z', device_id=99)
+
+def test_block_survives_later_unions():
+    """Test that a cluster merged into a blocked one becomes blocked"""
+    index = EntityLinkIndex()
+    index.link(1, device_id=10)
+    index.block(1)
+    index.link(2, card_hash='card-a')
+    index.link(3, card_hash='card-a', device_id=10)
+    
+    assert index.is_blocked(2)
+    assert index.cluster_size(2) == 5
+
+def test_cluster_size_is_capped():
+    """Test that widely shared identifiers cannot chain unrelated users together"""
+    index = EntityLinkIndex(max_cluster_size=4)
+    for user_id in range(10):
+        index.link(user_id, card_hash='masked-card')
+    index.block(0)
+    
+    assert index.cluster_size(0) == 4
+    assert index.skipped_unions == 7
+    assert not index.is_blocked(9)
+
+def test_window_state_denies_linked_users():
+    """Test that rule 1 checks cluster membership in the window state"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0).timestamp()
+    
+    assert state.check_and_add(1, 1, ts, 10.0, 3, 1000.0, device_id=10, card_hash='card-a').rule is None
+    assert state.check_and_add(2, 2, ts, 10.0, 3, 1000.0, device_id=20, card_hash='card-a').rule is None
+    state.block_user(1)
+    
+    assert state.check_and_add(3, 1, ts + 60, 10.0, 3, 1000.0).rule == RULE_CHARGEBACK
+    assert state.check_and_add(4, 2, ts + 60, 10.0, 3, 1000.0).rule == RULE_LINKED_CHARGEBACK
+    assert state.check_and_add(5, 3, ts + 60, 10.0, 3, 1000.0, device_id=20).rule == RULE_LINKED_CHARGEBACK
+    assert state.check_and_add(6, 4, ts + 60, 10.0, 3, 1000.0, device_id=40).rule is None
+
+def test_rebuild_links_from_transactions_table():
+    """Test the bulk rebuild path from stored transactions and chargebacks"""
+    with get_db() as conn:
+        conn.executemany("INSERT INTO transactions VALUES (?, 1, ?, ?, '2024-01-01T10:00:00', 10.0, ?, ?)", [
+            (1, 100, 'card-a', 10, True),
+            (2, 200, 'card-a', 20, False),
+            (3, 300, 'card-b', 20, False),
+            (4, 400, 'card-c', 40, False),
+            (5, 500, 'masked-card', 50, True),
+            (6, 600, 'masked-card', 60, False),
+        ])
+        conn.executemany("INSERT INTO linkable_cards VALUES (?)", [('card-a',), ('card-b',), ('card-c',)])
+        conn.commit()
+    
+    state = WindowState()
+    stats = state.rebuild_links(TEST_DB)
+    
+    assert stats["blocked_clusters"] == 2
+    assert state.is_blocked(300)
+    assert not state.is_blocked(400)
+    assert not state.is_blocked(600)
+
+def test_masked_cards_do_not_link_users():
+    """Test that users sharing only a masked card number are not linked"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0).timestamp()
+    
+    assert state.check_and_add(1, 1, ts, 10.0, 3, 1000.0, card_hash='masked', link_card=False).rule is None
+    assert state.check_and_add(2, 2, ts, 10.0, 3, 1000.0, card_hash='masked', link_card=False).rule is None
+    state.block_user(1)
+    
+    assert state.check_and_add(3, 2, ts + 60, 10.0, 3, 1000.0, card_hash='masked', link_card=False).rule is None
+
+def test_rebuild_keeps_links_made_meanwhile(monkeypatch):
+    """Test that links added while the table is being read survive the swap"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0).timestamp()
+    
+    def link_during_read(users):
+        state.add(1, 700, ts, 10.0, device_id=70)
+        state.add(2, 800, ts, 10.0, device_id=70)
+        return set()
+    
+    monkeypatch.setattr('src.state._chargeback_users', link_during_read)
+    state.rebuild_links(TEST_DB)
+    
+    state.block_user(700)
+    assert state.is_blocked(800)
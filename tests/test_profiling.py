@@ -0,0 +1,143 @@
+"""
+Unit tests for on-demand profiling.
+"""
+
+import os
+import queue
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from src import database
+
+TEST_DB = 'test_profiling.db'
+# Redirect before importing the app, which initializes the database on import
+database.DB_FILE = TEST_DB
+
+from src.database import init_db
+from src.main import app
+from src.profiling import SamplingProfiler, span, start_request_profile, format_server_timing
+from src.settings import settings
+from src.state import reset_window_state
+
+ADMIN_TOKEN = 'test-admin-token'
+
+client = TestClient(app)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database and admin token"""
+    previous_db, previous_token = database.DB_FILE, settings.admin_token
+    database.DB_FILE = TEST_DB
+    settings.admin_token = ADMIN_TOKEN
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    reset_window_state()
+    
+    yield
+    
+    reset_window_state()
+    database.DB_FILE, settings.admin_token = previous_db, previous_token
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def transaction(transaction_id):
+    return {
+        "transaction_id": transaction_id,
+        "merchant_id": 12345,
+        "user_id": 11111,
+        "card_number": "434505******9116",
+        "transaction_date": "2024-01-01T10:00:00",
+        "transaction_amount": 100.0,
+        "device_id": 12345
+    }
+
+def test_profile_header_returns_span_breakdown():
+    """Test that an admin profiling request gets a Server-Timing breakdown"""
+    response = client.post("/antifraud", json=transaction(8000001),
+                           headers={"X-Profile": "1", "X-Admin-Token": ADMIN_TOKEN})
+    
+    assert response.status_code == 200
+    timing = response.headers["Server-Timing"]
+    for stage in ("hash_card", "db_connect", "window_state", "store", "handler", "validation_and_framework", "total"):
+        assert f"{stage};dur=" in timing
+
+def test_profile_requires_admin_token():
+    """Test that profiling is ignored without a valid admin token"""
+    response = client.post("/antifraud?profile=1", json=transaction(8000002),
+                           headers={"X-Admin-Token": "wrong"})
+    
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+    assert client.get("/admin/profiler").status_code == 403
+
+def test_profile_flag_is_parsed_as_boolean():
+    """Test that profile=0 does not turn profiling on"""
+    response = client.post("/antifraud?profile=0", json=transaction(8000003),
+                           headers={"X-Admin-Token": ADMIN_TOKEN})
+    assert "Server-Timing" not in response.headers
+    
+    response = client.post("/antifraud?profile=true", json=transaction(8000004),
+                           headers={"X-Admin-Token": ADMIN_TOKEN})
+    assert "Server-Timing" in response.headers
+
+def test_span_is_noop_without_profile():
+    """Test that spans record nothing outside a profiled request"""
+    def run():
+        with span('stage'):
+            pass
+        spans = start_request_profile()
+        with span('stage'):
+            pass
+        assert [name for name, _ in spans] == ['stage']
+        assert format_server_timing([('stage', 0.0015)]) == 'stage;dur=1.500'
+    
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+def test_sampling_profiler_produces_folded_stacks():
+    """Test that the sampling profiler aggregates folded stacks for a time window"""
+    stop = threading.Event()
+    
+    def busy_worker():
+        while not stop.is_set():
+            sum(range(1000))
+    
+    worker = threading.Thread(target=busy_worker, name="busy-worker")
+    worker.start()
+    profiler = SamplingProfiler()
+    try:
+        assert profiler.start(interval=0.001, duration=0.05)
+        time.sleep(0.1)
+        profiler.stop()
+    finally:
+        stop.set()
+        worker.join()
+    
+    assert not profiler.running
+    assert profiler.samples > 0
+    lines = profiler.folded().splitlines()
+    assert any(line.startswith("busy-worker;") and "busy_worker" in line for line in lines)
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+def test_sampling_profiler_skips_idle_threads():
+    """Test that threads waiting on a queue are left out unless asked for"""
+    work = queue.Queue()
+    worker = threading.Thread(target=work.get, name="idle-worker")
+    worker.start()
+    try:
+        time.sleep(0.01)
+        profiler = SamplingProfiler()
+        profiler.sample()
+        assert "idle-worker;" not in profiler.folded()
+        
+        profiler.include_idle = True
+        profiler.sample()
+        assert "idle-worker;" in profiler.folded()
+    finally:
+        work.put(None)
+        worker.join()
@@ -0,0 +1,124 @@
+"""
+Unit tests for risk scoring.
+"""
+
+import os
+import threading
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from src import database
+
+TEST_DB = 'test_scoring.db'
+TEST_MODEL = 'test_risk_model.npz'
+# Redirect before importing the app, which initializes the database on import
+database.DB_FILE = TEST_DB
+
+from src.database import init_db
+from src.idempotency import decision_cache
+from src.main import app
+from src.scoring import RiskModel, BatchScorer, FEATURES, build_features, reset_risk_scorer
+from src.settings import settings
+from src.state import WindowCheck, reset_window_state
+
+client = TestClient(app)
+
+def amount_model(threshold=0.5):
+    """Model whose score only grows with log_amount (~0.5 at $500)"""
+    weights = np.zeros(len(FEATURES))
+    weights[FEATURES.index('log_amount')] = 10.0
+    return RiskModel(weights, -10.0 * np.log1p(500.0), np.zeros(len(FEATURES)), np.ones(len(FEATURES)), threshold)
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database and model file"""
+    previous = database.DB_FILE
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    decision_cache.clear()
+    reset_window_state()
+    reset_risk_scorer()
+    
+    yield
+    
+    settings.risk_model_path = None
+    reset_risk_scorer()
+    reset_window_state()
+    database.DB_FILE = previous
+    for path in (TEST_DB, TEST_MODEL):
+        if os.path.exists(path):
+            os.remove(path)
+
+def test_build_features():
+    """Test feature extraction from a window check"""
+    check = WindowCheck(None, 1, 300.0, 2.0, 1.0, count_day=3, device_changed=True)
+    features = dict(zip(FEATURES, build_features(200.0, check)))
+    
+    assert features['count_day'] == 3.0
+    assert features['amount_ratio'] == pytest.approx(2.0)
+    assert features['device_changed'] == 1.0
+    assert features['log_amount'] == pytest.approx(np.log1p(200.0))
+
+def test_model_save_and_load():
+    """Test that a saved model predicts the same batch after loading"""
+    model = amount_model(threshold=0.7)
+    model.save(TEST_MODEL)
+    loaded = RiskModel.load(TEST_MODEL)
+    
+    X = np.array([build_features(a, WindowCheck(None, 0, 0.0, 1.0, 1.0)) for a in (10.0, 500.0, 5000.0)])
+    np.testing.assert_allclose(loaded.predict(X), model.predict(X))
+    assert loaded.threshold == 0.7
+    assert loaded.predict(X)[1] == pytest.approx(0.5)
+
+def test_batch_scorer_batches_concurrent_requests():
+    """Test that concurrent callers get their own scores from shared batches"""
+    model = amount_model()
+    scorer = BatchScorer(model, max_wait=0.005)
+    amounts = [float(a) for a in range(10, 1010, 50)]
+    results = {}
+    
+    def worker(amount):
+        results[amount] = scorer.score(build_features(amount, WindowCheck(None, 0, 0.0, 1.0, 1.0)))
+    
+    threads = [threading.Thread(target=worker, args=(a,)) for a in amounts]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    
+    for amount in amounts:
+        expected = model.predict([build_features(amount, WindowCheck(None, 0, 0.0, 1.0, 1.0))])[0]
+        assert results[amount] == pytest.approx(expected)
+    assert scorer.scored == len(amounts)
+    assert scorer.batches < len(amounts)
+
+def test_risk_score_denies_after_rules():
+    """Test that a configured model denies high-risk transactions"""
+    amount_model().save(TEST_MODEL)
+    settings.risk_model_path = TEST_MODEL
+    payload = {
+        "transaction_id": 9100001,
+        "merchant_id": 12345,
+        "user_id": 10101,
+        "card_number": "434505******9116",
+        "transaction_date": datetime.now(timezone.utc).isoformat(),
+        "transaction_amount": 100.0,
+        "device_id": 12345
+    }
+    
+    assert client.post("/antifraud", json=payload).json()["recommendation"] == "approve"
+    response = client.post("/antifraud", json={**payload, "transaction_id": 9100002, "transaction_amount": 900.0})
+    assert response.json()["recommendation"] == "deny"
+
+def test_missing_model_fails_at_startup():
+    """Test that a bad model path stops the app from starting instead of failing requests"""
+    settings.risk_model_path = TEST_MODEL
+    
+    with pytest.raises(FileNotFoundError):
+        with TestClient(app):
+            pass
@@ -0,0 +1,53 @@
+"""
+Tests for the multi-worker entrypoint.
+"""
+
+import gc
+import os
+
+import pytest
+
+from src import database, serve
+from src.settings import settings
+from src.state import StateManager
+
+TEST_DB = 'test_serve.db'
+
+@pytest.fixture(autouse=True)
+def setup_db(monkeypatch):
+    """Point the entrypoint at a fresh database file"""
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    monkeypatch.setattr(database, 'DB_FILE', TEST_DB)
+    
+    yield
+    
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def test_main_starts_a_state_owner_workers_can_reach(monkeypatch):
+    """Test that the owner started by main outlives it and serves a fresh database"""
+    monkeypatch.setattr(settings, 'workers', 2)
+    monkeypatch.setattr(settings, 'state_address', None)
+    monkeypatch.delenv('STATE_ADDRESS', raising=False)
+    seen = {}
+    
+    def run(app, **kwargs):
+        # Stands in for uvicorn: connect the way a worker would
+        gc.collect()
+        manager = StateManager(address=os.environ['STATE_ADDRESS'], authkey=settings.state_authkey.encode())
+        manager.connect()
+        seen['stats'] = manager.get_state().stats()
+        seen['workers'] = kwargs['workers']
+    
+    monkeypatch.setattr(serve.uvicorn, 'run', run)
+    try:
+        serve.main()
+    finally:
+        if serve._state_owner is not None:
+            serve._state_owner.shutdown()
+            serve._state_owner = None
+        os.environ.pop('STATE_ADDRESS', None)
+    
+    assert seen['workers'] == 2
+    assert seen['stats']['transactions'] == 0
@@ -0,0 +1,107 @@
+"""
+Unit tests for shadow rule evaluation.
+"""
+
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src import database
+from src.database import init_db, get_db
+from src.models import RuleSet
+from src.shadow import ShadowEvaluator, CandidateState
+from src.state import reset_window_state
+
+TEST_DB = 'test_shadow.db'
+
+class Txn:
+    def __init__(self, transaction_id, user_id, amount):
+        self.transaction_id = transaction_id
+        self.user_id = user_id
+        self.transaction_amount = amount
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database"""
+    previous = database.DB_FILE
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    reset_window_state()
+    
+    yield
+    
+    reset_window_state()
+    database.DB_FILE = previous
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def test_candidate_uses_own_thresholds():
+    """Test that a candidate rule set applies its own limits to its own state"""
+    candidate = CandidateState(RuleSet(name="strict", max_transactions_per_2min=1, max_amount_per_24h=500))
+    now = datetime.now(timezone.utc)
+    
+    assert candidate.evaluate(1, 1, now, 100.0, False) == ('approve', None)
+    assert candidate.evaluate(2, 1, now + timedelta(seconds=10), 100.0, False) == ('deny', 'velocity')
+    assert candidate.evaluate(3, 1, now + timedelta(minutes=5), 450.0, False) == ('deny', 'amount')
+    assert candidate.evaluate(4, 2, now, 100.0, True) == ('deny', 'chargeback')
+
+def test_candidate_starts_from_stored_transactions():
+    """Test that a candidate's windows include transactions approved before a restart"""
+    now = datetime.now(timezone.utc)
+    with get_db() as conn:
+        conn.execute("INSERT INTO transactions VALUES (1, 1, 5, 'hash', ?, 400.0, 1, 0)", (now.isoformat(),))
+        conn.commit()
+    
+    candidate = CandidateState(RuleSet(name="strict", max_amount_per_24h=500))
+    assert candidate.evaluate(2, 5, now + timedelta(minutes=5), 200.0, False) == ('deny', 'amount')
+
+def test_disagreements_are_recorded():
+    """Test that shadow decisions differing from live ones are stored"""
+    evaluator = ShadowEvaluator([RuleSet(name="strict", max_amount_per_24h=50)], queue_size=10)
+    now = datetime.now(timezone.utc)
+    
+    assert evaluator.submit(Txn(1, 10, 100.0), now, 'approve', None)
+    assert evaluator.submit(Txn(2, 11, 20.0), now, 'approve', None)
+    evaluator.join()
+    
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT rule_set, transaction_id, shadow_recommendation, shadow_rule FROM shadow_disagreements"
+        ).fetchall()
+    assert rows == [("strict", 1, "deny", "amount")]
+    assert evaluator.stats()["disagreements"] == 1
+
+def test_candidate_matching_live_rules_agrees_after_startup():
+    """Test that live decisions stored before the candidate state loads are not counted twice"""
+    evaluator = ShadowEvaluator([RuleSet(name="same")], queue_size=10)
+    now = datetime.now(timezone.utc)
+    with get_db() as conn:
+        for i in range(3):
+            conn.execute("INSERT INTO transactions VALUES (?, 1, 12, 'hash', ?, 10.0, 1, 0)",
+                         (i + 1, (now + timedelta(seconds=i)).isoformat()))
+        conn.commit()
+    
+    for i in range(3):
+        evaluator.submit(Txn(i + 1, 12, 10.0), now + timedelta(seconds=i), 'approve', None)
+    evaluator.join()
+    
+    assert evaluator.stats()["disagreements"] == 0
+
+def test_full_queue_drops_instead_of_blocking():
+    """Test that a full queue drops records and counts the drops"""
+    evaluator = ShadowEvaluator([RuleSet(name="strict")], queue_size=1)
+    evaluator._worker = object()  # keep the worker from draining the queue
+    now = datetime.now(timezone.utc)
+    
+    assert evaluator.submit(Txn(1, 10, 10.0), now, 'approve', None)
+    assert not evaluator.submit(Txn(2, 10, 10.0), now, 'approve', None)
+    assert evaluator.stats()["dropped"] == 1
+
+def test_disabled_without_rule_sets():
+    """Test that nothing is queued when no candidate rule sets are configured"""
+    evaluator = ShadowEvaluator([], queue_size=10)
+    assert not evaluator.submit(Txn(1, 10, 10.0), datetime.now(timezone.utc), 'approve', None)
+    assert evaluator.stats()["enqueued"] == 0
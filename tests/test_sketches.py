@@ -0,0 +1,45 @@
+"""
+Unit tests for cardinality sketches.
+"""
+
+import pytest
+
+from src.sketches import HyperLogLog, WindowedSketch, hash64
+
+@pytest.mark.parametrize("n", [1, 10, 100, 5000])
+def test_hyperloglog_estimate_is_close(n):
+    """Test HyperLogLog accuracy across small and large cardinalities"""
+    sketch = HyperLogLog(p=10)
+    for i in range(n):
+        sketch.add(hash64(i))
+        sketch.add(hash64(i))
+    
+    assert abs(sketch.estimate() - n) <= max(1, 0.1 * n)
+
+def test_hyperloglog_merge():
+    """Test that merged sketches estimate the union"""
+    a, b = HyperLogLog(p=8), HyperLogLog(p=8)
+    for i in range(50):
+        a.add(hash64(i))
+        b.add(hash64(i + 25))
+    a.merge(b)
+    
+    assert abs(a.estimate() - 75) <= 8
+
+def test_windowed_sketch_memory_is_fixed():
+    """Test that the ring never grows beyond its buckets"""
+    sketch = WindowedSketch(window_seconds=24 * 3600, bucket_seconds=3600, p=6)
+    for i in range(1000):
+        sketch.add(i * 600.0, hash64(i))
+    
+    assert len(sketch._slots) == 25
+    assert sketch.estimate(999 * 600.0) == pytest.approx(145, rel=0.2)
+
+def test_windowed_sketch_counts_extra_item():
+    """Test that an extra item is counted without being added"""
+    sketch = WindowedSketch(window_seconds=3600, bucket_seconds=600)
+    sketch.add(0.0, hash64('a'))
+    
+    assert round(sketch.estimate(10.0, hash64('b'))) == 2
+    assert round(sketch.estimate(10.0)) == 1
+    assert round(sketch.estimate(10.0, hash64('a'))) == 1
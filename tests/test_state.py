@@ -0,0 +1,247 @@
+"""
+Unit tests for the shared window state.
+"""
+
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from src import database
+from src.database import init_db, get_db
+from src.models import parse_transaction_date
+from src.state import (
+    UserWindow, WindowState, StateManager, start_state_owner,
+    RULE_CHARGEBACK, RULE_VELOCITY, RULE_AMOUNT, RULE_LATE, RULE_FUTURE,
+    RULE_DISTINCT_DEVICES, RULE_DISTINCT_CARDS
+)
+
+TEST_DB = 'test_state.db'
+
+@pytest.fixture(autouse=True)
+def setup_db():
+    """Setup and teardown test database"""
+    previous = database.DB_FILE
+    database.DB_FILE = TEST_DB
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+    init_db()
+    
+    yield
+    
+    database.DB_FILE = previous
+    if os.path.exists(TEST_DB):
+        os.remove(TEST_DB)
+
+def test_window_rules():
+    """Test velocity, amount and chargeback rules on the in-memory state"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    for i in range(3):
+        assert state.check_and_add(i, 1, ts + i * 10, 10.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(3, 1, ts + 40, 10.0, 3, 1000.0)[0] == RULE_VELOCITY
+    assert state.check_and_add(4, 1, ts + 600, 980.0, 3, 1000.0)[0] == RULE_AMOUNT
+    assert state.check_and_add(5, 1, ts + 25 * 3600, 980.0, 3, 1000.0)[0] is None
+    
+    state.block_user(1)
+    assert state.check_and_add(6, 1, ts + 26 * 3600, 1.0, 3, 1000.0)[0] == RULE_CHARGEBACK
+
+def test_out_of_order_events_use_event_time_windows():
+    """Test that later-timestamped transactions do not count against an earlier one"""
+    state = WindowState(max_lateness=300)
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    for i in range(3):
+        assert state.check_and_add(i, 1, ts + 60 + i, 100.0, 3, 1000.0)[0] is None
+    
+    # Arrives last but happened first: its [t-2min, t] window is empty
+    check = state.check_and_add(3, 1, ts, 100.0, 3, 1000.0)
+    assert (check.rule, check.count_recent, check.total_day) == (None, 0, 0.0)
+    
+    # Its presence is seen by events after it
+    assert state.check_and_add(4, 1, ts + 62.5, 100.0, 3, 1000.0)[0] == RULE_VELOCITY
+
+def test_lateness_is_bounded():
+    """Test that events later than the configured bound are rejected"""
+    state = WindowState(max_lateness=60)
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    assert state.check_and_add(1, 1, ts, 10.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(2, 1, ts - 30, 10.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(3, 1, ts - 61, 10.0, 3, 1000.0)[0] == RULE_LATE
+
+def test_future_events_cannot_move_the_watermark():
+    """Test that a far-future event is denied instead of locking the user out"""
+    state = WindowState(max_lateness=60, max_future=300)
+    now = time.time()
+    
+    assert state.check_and_add(1, 1, now + 365 * 24 * 3600, 10.0, 3, 1000.0)[0] == RULE_FUTURE
+    assert state.check_and_add(2, 1, now, 10.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(3, 1, now + 60, 10.0, 3, 1000.0)[0] is None
+
+def test_naive_dates_are_utc():
+    """Test that dates without an offset are read as UTC whatever the local timezone"""
+    utc = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    assert parse_transaction_date('2024-01-01T10:00:00').timestamp() == utc
+    assert parse_transaction_date('2024-01-01T07:00:00-03:00').timestamp() == utc
+
+def test_window_totals_match_sums_under_any_arrival_order():
+    """Test that running totals survive out-of-order inserts, removals and pruning"""
+    rng = random.Random(7)
+    window = UserWindow(60, 10)
+    live = {}
+    for transaction_id in range(500):
+        ts = 1000.0 + transaction_id * 10 + rng.uniform(-300, 300)
+        amount = round(rng.uniform(1, 100), 2)
+        window.insert(transaction_id, ts, amount)
+        live[transaction_id] = (ts, amount)
+        if rng.random() < 0.2:
+            removed = rng.choice(list(live))
+            window.remove(removed)
+            del live[removed]
+        if transaction_id % 50 == 0:
+            before = ts - 1000
+            window.prune(before)
+            live = {t: v for t, v in live.items() if v[0] >= before}
+        
+        start = ts - rng.uniform(0, 2000)
+        expected = sum(a for t, a in live.values() if start <= t <= ts)
+        assert window.total(start, ts) == pytest.approx(expected)
+        assert window.count(start, ts) == sum(1 for t, _ in live.values() if start <= t <= ts)
+
+def test_remove_rolls_back_watermark():
+    """Test that removing the newest transaction restores the previous watermark"""
+    state = WindowState(max_lateness=60)
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    assert state.check_and_add(1, 1, ts, 10.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(2, 1, ts + 600, 10.0, 3, 1000.0)[0] is None
+    state.remove(1, 2)
+    assert state.check_and_add(3, 1, ts + 30, 10.0, 3, 1000.0)[0] is None
+
+def test_old_transactions_are_pruned():
+    """Test that history beyond 24h plus lateness is dropped"""
+    state = WindowState(max_lateness=60)
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    state.add(1, 1, ts, 10.0)
+    state.add(2, 1, ts + 24 * 3600 + 61, 10.0)
+    assert state.stats()["transactions"] == 1
+
+def test_distinct_device_and_card_rules():
+    """Test that distinct device/card limits use the per-user sketches"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    for i in range(3):
+        check = state.check_and_add(i, 1, ts + i * 600, 1.0, 3, 1000.0,
+                                    device_id=100 + i, card_hash='card', max_devices=3, max_cards=1)
+        assert check.rule is None
+    
+    check = state.check_and_add(3, 1, ts + 1800, 1.0, 3, 1000.0,
+                                device_id=200, card_hash='card', max_devices=3, max_cards=1)
+    assert check.rule == RULE_DISTINCT_DEVICES
+    assert round(check.distinct_devices) == 4
+    
+    check = state.check_and_add(4, 1, ts + 1800, 1.0, 3, 1000.0,
+                                device_id=100, card_hash='other', max_devices=3, max_cards=1)
+    assert check.rule == RULE_DISTINCT_CARDS
+    
+    # Devices seen more than 24h ago no longer count
+    check = state.check_and_add(5, 1, ts + 27 * 3600, 1.0, 3, 1000.0,
+                                device_id=200, card_hash='card', max_devices=3, max_cards=1)
+    assert check.rule is None
+    assert round(check.distinct_devices) == 1
+
+def test_remove_releases_reservation():
+    """Test that removing a recorded transaction frees its window slot"""
+    state = WindowState()
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    assert state.check_and_add(1, 1, ts, 900.0, 3, 1000.0)[0] is None
+    assert state.check_and_add(2, 1, ts + 1, 900.0, 3, 1000.0)[0] == RULE_AMOUNT
+    state.remove(1, 1)
+    assert state.check_and_add(2, 1, ts + 1, 900.0, 3, 1000.0)[0] is None
+
+def test_provisional_add_defers_sketches_and_watermark():
+    """Test that a provisional transaction only reserves its window slot until confirmed"""
+    state = WindowState(max_lateness=60)
+    ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+    
+    check = state.check_and_add(1, 1, ts, 900.0, 3, 1000.0, device_id=100, provisional=True)
+    assert check.rule is None
+    assert state.check_and_add(2, 1, ts + 1, 900.0, 3, 1000.0)[0] == RULE_AMOUNT
+    
+    # Dropped: no device, watermark or link is left behind
+    state.remove(1, 1)
+    check = state.check_and_add(3, 1, ts - 3600, 10.0, 3, 1000.0, device_id=200, provisional=True)
+    assert check.rule is None
+    assert round(check.distinct_devices) == 1
+    assert not check.device_changed
+    assert state.stats()["entity_links"]["nodes"] == 0
+    
+    state.confirm(3, 1, ts - 3600, device_id=200)
+    check = state.check_and_add(4, 1, ts - 3600 + 10, 10.0, 3, 1000.0, device_id=300)
+    assert round(check.distinct_devices) == 2
+    assert check.device_changed
+    assert state.check_and_add(5, 1, ts - 3600 - 61, 10.0, 3, 1000.0)[0] == RULE_LATE
+
+def test_load_from_db():
+    """Test that windows and blocklist are rebuilt from the database"""
+    with get_db() as conn:
+        conn.execute("INSERT INTO transactions VALUES (1, 1, 10, 'h', '2024-01-01T10:00:00', 900.0, 1, 0)")
+        conn.execute("INSERT INTO users VALUES (10, 0)")
+        conn.execute("INSERT INTO users VALUES (20, 1)")
+        conn.commit()
+    
+    state = WindowState()
+    state.load_from_db(TEST_DB)
+    ts = datetime(2024, 1, 1, 11, 0, tzinfo=timezone.utc).timestamp()
+    
+    assert state.check_and_add(2, 10, ts, 200.0, 3, 1000.0)[0] == RULE_AMOUNT
+    assert state.check_and_add(3, 20, ts, 1.0, 3, 1000.0)[0] == RULE_CHARGEBACK
+
+def test_sync_from_db_picks_up_external_writes():
+    """Test that rows written by other processes reach an already loaded state"""
+    with get_db() as conn:
+        conn.execute("INSERT INTO transactions VALUES (1, 1, 10, 'h', '2024-01-01T10:00:00', 100.0, 1, 0)")
+        conn.commit()
+    state = WindowState()
+    state.load_from_db(TEST_DB)
+    
+    with get_db() as conn:
+        conn.execute("INSERT INTO transactions VALUES (2, 1, 10, 'h', '2024-01-01T10:30:00', 800.0, 1, 0)")
+        conn.execute("INSERT INTO transactions VALUES (3, 1, 20, 'g', '2024-01-01T10:30:00', 5.0, 2, 1)")
+        conn.commit()
+    
+    assert state.sync_from_db(TEST_DB) == {"transactions": 2, "blocked_users": 1}
+    assert state.sync_from_db(TEST_DB) == {"transactions": 0, "blocked_users": 0}
+    ts = datetime(2024, 1, 1, 11, 0, tzinfo=timezone.utc).timestamp()
+    assert state.check_and_add(4, 10, ts, 200.0, 3, 1000.0)[0] == RULE_AMOUNT
+    assert state.check_and_add(5, 20, ts, 1.0, 3, 1000.0)[0] == RULE_CHARGEBACK
+
+def test_workers_share_state_through_owner_process():
+    """Test that separate manager connections see the same per-user state"""
+    address = os.path.join(tempfile.mkdtemp(), 'state.sock')
+    owner = start_state_owner(address, 'secret')
+    try:
+        workers = []
+        for _ in range(2):
+            manager = StateManager(address=address, authkey=b'secret')
+            manager.connect()
+            workers.append(manager.get_state())
+        
+        ts = datetime(2024, 1, 1, 10, 0, tzinfo=timezone.utc).timestamp()
+        for i in range(3):
+            assert workers[i % 2].check_and_add(i, 1, ts + i, 10.0, 3, 1000.0)[0] is None
+        assert workers[1].check_and_add(3, 1, ts + 3, 10.0, 3, 1000.0)[0] == RULE_VELOCITY
+        
+        workers[0].block_user(2)
+        assert workers[1].is_blocked(2)
+    finally:
+        owner.shutdown()